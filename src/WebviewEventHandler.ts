@@ -1,9 +1,10 @@
 import * as vscode from 'vscode';
 import { 
-	nodeIdStringIsStartOrEnd, sourceDocUri, currentPanel, 
+	nodeIdStringIsStartOrEnd, sourceDocUri, currentPanel, getFlowchartLineOffset, getSourceLocation,
 	// mapping relation
-	nodeIdToLine, lineToNodeMap, pseudocodeToLineMap
+	nodeIdToLine, lineToNodeMap, pseudocodeToLineMap, externalNodeTargets
 } from './extension';
+import { SymbolLocation } from './symbolIndex';
 
 // decoration type (top-level, cache it)
 const highlightDecorationType = vscode.window.createTextEditorDecorationType({
@@ -18,12 +19,25 @@ const highlightDecorationType = vscode.window.createTextEditorDecorationType({
 // event do:
 // 		1. highlight correspond line in TextEditor of orignal code
 // 		2. highlight correspond line in pseudo code
+// 		(external function nodes open their definition instead)
 export async function FlowchartNodeClickEventHandler(
 	message: any
 ): Promise<void> {
-	const editor = await getSourceEditor();   
 	console.log("receive message: nodeClicked %s", message.nodeId);
 
+	// external function node (from the workspace symbol index);
+	// jump to its definition in the other module
+	const external = externalNodeTargets.get(message.nodeId);
+	if (external) {
+		await revealExternalDefinition(external);
+		return;
+	}
+
+	// 流程圖行號換回所在文件的行號（筆記本為對應 cell 內的行號）
+	const line = nodeIdToLine.get(message.nodeId) ?? null;
+	const location = line ? getSourceLocation(line) : undefined;
+	const editor = await getSourceEditor(location?.uri);   
+
 	// check editor work
 	if (!editor) {
 		console.error("could not find vscode.window.activeTextEditor");
@@ -43,8 +57,7 @@ export async function FlowchartNodeClickEventHandler(
 	// normal case
 	// check the target line exist;
 	// o.w. exit and clear highlight
-	const line = nodeIdToLine.get(message.nodeId) ?? null;
-	if (!line) {
+	if (!line || !location) {
 		console.error("can not find related line in mapping: %s", message.nodeId);
 		clearEditor(editor);
 		clearHighlightInWebviewPanel();
@@ -56,7 +69,7 @@ export async function FlowchartNodeClickEventHandler(
 	// this event do for TextEditor Area
 	// 高亮 Python 編輯器中的對應行
 	const lines: number[] = [line];
-	const ranges = lines.map(ln => new vscode.Range(ln - 1, 0, ln - 1, Number.MAX_SAFE_INTEGER));
+	const ranges = [new vscode.Range(location.line - 1, 0, location.line - 1, Number.MAX_SAFE_INTEGER)];
 
 	highlightEditor(editor, ranges);
 	
@@ -76,7 +89,11 @@ export async function FlowchartNodeClickEventHandler(
 export async function handlePseudocodeLineClick(
 	pseudocodeLine: number
 ): Promise<void> {
-	const editor = await getSourceEditor();
+	// this event do for TextEditor Area
+	// 從映射中找到對應的 Python 行
+	const pythonLine = pseudocodeToLineMap?.get(pseudocodeLine);
+	const location = pythonLine ? getSourceLocation(pythonLine) : undefined;
+	const editor = await getSourceEditor(location?.uri);
 	
 	console.log('Pseudocode line clicked:', pseudocodeLine);
 	
@@ -85,13 +102,7 @@ export async function handlePseudocodeLineClick(
 		return;
 	}
 	
-	
-	
-	// this event do for TextEditor Area
-	// 從映射中找到對應的 Python 行
-	const pythonLine = pseudocodeToLineMap?.get(pseudocodeLine);
-	
-	if (!pythonLine) {
+	if (!pythonLine || !location) {
 		console.log('No Python line mapping found for pseudocode line:', pseudocodeLine);
 		clearEditor(editor);
 		clearHighlightInWebviewPanel();
@@ -101,7 +112,7 @@ export async function handlePseudocodeLineClick(
 	console.log('Mapped to Python line:', pythonLine);
 	
 	// 高亮 Python 編輯器中的對應行
-	const lineIndex = pythonLine - 1;
+	const lineIndex = location.line - 1;
 	const range = new vscode.Range(lineIndex, 0, lineIndex, Number.MAX_SAFE_INTEGER);
 	
 	highlightEditor(editor, [range]);
@@ -121,7 +132,8 @@ export async function handlePseudocodeLineClick(
 
 // 取得 flowchart 對應的 editor
 // 如果在生成 flowchart 之後切換 TextEditor，會導致 activeTextEditor 變成 undefined 要重新抓
-async function getSourceEditor(): Promise<vscode.TextEditor | undefined> {
+// uri：指定時找該文件（筆記本的某個 cell），否則找任一屬於目前流程圖的 editor
+async function getSourceEditor(uri?: vscode.Uri): Promise<vscode.TextEditor | undefined> {
     if (!sourceDocUri) {
 		console.error('找不到 flowchart 對應的 editor, 請打開正確頁面');
 		vscode.window.showWarningMessage('找不到 flowchart 對應的 editor, 請打開正確頁面');
@@ -130,7 +142,7 @@ async function getSourceEditor(): Promise<vscode.TextEditor | undefined> {
 
     // 先找可見的 visible editor
     const vis = vscode.window.visibleTextEditors.find(
-        (e) => e.document.uri.toString() === sourceDocUri!.toString()
+        (e) => uri ? e.document.uri.toString() === uri.toString() : getFlowchartLineOffset(e.document) !== undefined
     );
     if (vis) {
 		return vis;
@@ -169,6 +181,12 @@ function highlightEditor(
 	}
 
 	console.log('ranges: ', ranges);
+	// 筆記本的高亮可能換到另一個 cell，先清掉其他 editor 上的舊高亮
+	for (const other of vscode.window.visibleTextEditors) {
+		if (other !== editor) {
+			other.setDecorations(highlightDecorationType, []);
+		}
+	}
 	editor.setDecorations(highlightDecorationType, ranges);
 
 	// scroll to the first line
@@ -177,6 +195,21 @@ function highlightEditor(
 	}
 }
 
+async function revealExternalDefinition(target: SymbolLocation): Promise<void> {
+	try {
+		const doc = await vscode.workspace.openTextDocument(vscode.Uri.file(target.file));
+		const position = new vscode.Position(target.line - 1, 0);
+		await vscode.window.showTextDocument(doc, {
+			viewColumn: vscode.ViewColumn.One,
+			selection: new vscode.Range(position, position),
+			preserveFocus: false
+		});
+	} catch (error) {
+		console.error('failed to open external definition:', target, error);
+		vscode.window.showErrorMessage(`無法開啟 ${target.file}`);
+	}
+}
+
 export function clearEditor(editor: typeof vscode.window.activeTextEditor): void {
 	highlightEditor(editor, []);
 }
@@ -1,4 +1,5 @@
 import axios from 'axios';
+import type { PromptSkeleton } from './pythonAnalyzer';
 
 export interface LineMapping {
     pythonLine: number;
@@ -119,7 +120,49 @@ function buildLineMapping(pythonCode: string, pseudocode: string): LineMapping[]
     return mapping;
 }
 
-export async function codeToPseudocode(code: string): Promise<PseudocodeResult> {
+// 骨架模式：回應的每一行帶著原始行號，依此直接對回 Python 行（多行語句整段對到同一行）
+const NUMBERED_LINE = /^\s*(\d+)\|\s?(.*)$/;
+
+export function parseNumberedPseudocode(text: string, ranges: Record<string, number>): PseudocodeResult | undefined {
+    const pseudoLines: string[] = [];
+    const mapping: LineMapping[] = [];
+    let numbered = 0;
+
+    for (const line of text.split('\n')) {
+        const match = NUMBERED_LINE.exec(line);
+        if (!match) {
+            pseudoLines.push(line);
+            continue;
+        }
+        numbered++;
+        pseudoLines.push(match[2]);
+        const firstLine = Number(match[1]);
+        const lastLine = ranges[match[1]] ?? firstLine;
+        for (let pythonLine = firstLine; pythonLine <= lastLine; pythonLine++) {
+            mapping.push({ pythonLine, pseudocodeLine: pseudoLines.length });
+        }
+    }
+
+    // 模型沒有照格式輸出行號時交給呼叫端改用逐行比對
+    if (numbered === 0) {
+        return undefined;
+    }
+    console.log('Line mapping from line numbers:', mapping.length, 'mappings');
+    return { pseudocode: pseudoLines.join('\n'), lineMapping: mapping };
+}
+
+const SKELETON_RULES = `
+
+### Compact Input Format
+
+The code below is a skeleton: comments and docstrings are removed, and long literals are elided as '…' or ...
+- Every input line starts with its original line number followed by "| "
+- Start every pseudocode line with the same line number and "| " as the statement it converts, then the indented pseudocode
+- Keep elided literals elided; do not guess their contents
+`;
+
+// skeleton：指定時改送 AST 骨架（較少 token），行號映射由回應中的行號取得
+export async function codeToPseudocode(code: string, skeleton?: PromptSkeleton): Promise<PseudocodeResult> {
     const apiKey = process.env.CLAUDE_API_KEY;
     console.log('在 claudeApi.ts 中檢查 API Key:', !!apiKey);
     console.log('所有環境變數:', Object.keys(process.env).filter(key => key.includes('CLAUDE')));
@@ -294,7 +337,9 @@ OUTPUT y
 - Preserve the logical flow and structure of the original code
 - Nested structures should have correspondingly deeper indentation
 
-When given code, respond with only the pseudocode using the above conventions:\n${code}`;
+When given code, respond with only the pseudocode using the above conventions:${skeleton ? SKELETON_RULES : ''}\n${skeleton ? skeleton.skeleton : code}`;
+    const mode = skeleton ? 'skeleton' : 'full source';
+    const requestStart = Date.now();
 
     try {
         const response = await axios.post(
@@ -329,7 +374,17 @@ When given code, respond with only the pseudocode using the above conventions:\n
         }
 
         console.log('Pseudocode received, length:', pseudocode.length);
-        
+        // 比較骨架與完整原始碼兩種模式的 token 數與延遲
+        const usage = response.data.usage;
+        console.log(`Claude request (${mode}): prompt ${userMessage.length} chars, `
+            + `input ${usage?.input_tokens ?? '?'} tokens, output ${usage?.output_tokens ?? '?'} tokens, `
+            + `${Date.now() - requestStart} ms`);
+
+        const numbered = skeleton ? parseNumberedPseudocode(pseudocode, skeleton.ranges) : undefined;
+        if (numbered) {
+            return numbered;
+        }
+
         const lineMapping = buildLineMapping(code, pseudocode);
 
         return {
@@ -1,8 +1,11 @@
 import * as vscode from 'vscode';
 import * as path from 'path';
-import { codeToPseudocode, PseudocodeResult } from './claudeApi';
-import * as dotenv from 'dotenv';
-import { parsePythonWithAST } from './pythonAnalyzer';
+import * as crypto from 'crypto';
+import * as os from 'os';
+import type { PseudocodeResult } from './claudeApi';
+import { parsePythonWithAST, generatePromptSkeleton, generateLocalPseudocode, FlowchartAnalysis, PromptSkeleton } from './pythonAnalyzer';
+import { WorkspaceSymbolIndex, SymbolLocation } from './symbolIndex';
+import { NotebookAnalysisCache, NotebookCellSpan, findCellSpan } from './notebookFlowchart';
 import { FlowchartNodeClickEventHandler, clearEditor, handlePseudocodeLineClick,
     clearHighlightInWebviewPanel, highlightNodesAndPseudocodeInWebview
 } from './WebviewEventHandler';
@@ -25,16 +28,90 @@ export let lineToNodeMap: Map<number, string[]> = new Map();
 let currentLineMapping: Array<{pythonLine: number, pseudocodeLine: number}> = [];
 export let pseudocodeToLineMap: Map<number, number> = new Map();
 let fullPseudocodeGenerated = false;
+// 目前顯示的是否為 Claude 生成的版本；否則為本地規則產生的版本（可被 Claude 的結果取代）
+let llmPseudocodeGenerated = false;
+let llmPseudocodeHash = '';
+// 最近一次分析附帶的本地 pseudocode（整個檔案），程式碼未變時 Convert to Pseudocode 直接沿用
+let localPseudocode: { sourceHash: string, pseudocode: string } | undefined;
 export const nodeIdToLine = new Map<string, number | null>();
+//    externalNodeTargets : map 'nodeId-of-external-function' to its definition in another file
+export const externalNodeTargets = new Map<string, SymbolLocation>();
+
+// 工作區符號索引在第一次產生流程圖時才建立與掃描，不佔用啟動時間
+let symbolIndex: Promise<WorkspaceSymbolIndex> | undefined;
+
+// 範圍模式：只畫游標所在函式（或類別）的流程圖
+// 整個檔案仍交給 Python 解析，行號因此與原始檔一致；各範圍的分析結果依起始行快取，
+// 檔案內容變動（sourceHash 改變）時整批作廢
+interface ScopeSpan {
+    name: string;
+    start: number;
+    end: number;
+}
+
+const SCOPE_FOLLOW_DELAY_MS = 250;
+let scopedMode = false;
+let currentScopeStart: number | undefined;
+let scopeSpans: ScopeSpan[] = [];
+let scopeSourceHash = '';
+const scopeCache = new Map<number, FlowchartAnalysis>();
+let scopeFollowTimeout: NodeJS.Timeout | undefined;
+let scopeRequest = 0;
+
+// 最近一次生成的圖（含 webview 渲染完回報的 SVG），供 panel 隱藏後或 VS Code 重啟後還原
+// webview 端則以 vscode.setState 保存視角與高亮，兩者以 sourceHash 對應
+// 只有整個檔案的圖寫入 workspaceState（游標跟隨的範圍圖隨時會重畫），SVG 超過上限時只保存 mermaid 原始碼，還原時重新渲染
+const FLOWCHART_STATE_KEY = 'flowchart.lastGraph';
+const MAX_STORED_SVG_LENGTH = 1024 * 1024;
+let lastFlowchart: StoredFlowchart | undefined;
+
+// webview 載入完成（送出 webview.ready）前的訊息先排隊，避免片段或整張圖遺失
+let flowchartReady = false;
+let pendingFlowchartMessages: any[] = [];
+
+// 串流產生：每次生成整個檔案的流程圖遞增，webview 以此分辨片段屬於哪一次，
+// 並回報首次繪製（只有主流程）與完整繪製的時間
+let flowchartStreamId = 0;
+let streamStartTime = 0;
+let streamFirstPaint = false;
+
+// 冷啟動預算：activate 本身與開啟 panel 到 webview 可接收訊息的時間，超過時記錄警告
+// （axios、dotenv 延後到第一次呼叫 Claude API 才載入，符號索引延後到第一次產生流程圖才掃描）
+const ACTIVATION_BUDGET_MS = 50;
+const FIRST_PANEL_BUDGET_MS = 1000;
+let panelOpenStart = 0;
+
+// Jupyter 筆記本：各 code cell 分別分析並依內容雜湊快取，合併成一張圖；
+// 合併圖的行號是 cell 依序串接後的行號，notebookCells 負責與各 cell 內的行號互相轉換
+const notebookCache = new NotebookAnalysisCache();
+let notebookCells: NotebookCellSpan[] = [];
+let notebookSource = '';
+
+let extensionPath = '';
+let envLoaded = false;
+let claudeApi: Promise<typeof import('./claudeApi')> | undefined;
+
+interface StoredFlowchart {
+    sourceHash: string;
+    sourceUri: string;
+    mermaidCode: string;
+    lineMapping: string;
+    nodeOrder: string[];
+    nodeMeta: string;
+    metrics?: string;
+    notebookCells?: NotebookCellSpan[];
+    notebookSource?: string;
+    scoped?: boolean;
+    svg?: string;
+}
 
 export function activate(context: vscode.ExtensionContext) {
-    const extensionPath = context.extensionPath;
-    dotenv.config({ path: path.join(extensionPath, '.env') });
+    const activationStart = Date.now();
+    extensionPath = context.extensionPath;
 
     console.log('Code2Pseudocode extension is now active!');
     console.log('Extension path:', extensionPath);
-    console.log('CLAUDE_API_KEY exists:', !!process.env.CLAUDE_API_KEY);
-    
+
     const disposable = vscode.commands.registerCommand('code2pseudocode.convertToPseudocode', async () => {
         await convertToPseudocode();
     });
@@ -49,119 +126,130 @@ export function activate(context: vscode.ExtensionContext) {
                 pseudocodeCache.clear();
                 currentLineMapping = [];
                 fullPseudocodeGenerated = false;
+                llmPseudocodeGenerated = false;
             }
         }
     });
     
+    const serializerDisposable = vscode.window.registerWebviewPanelSerializer('pythonFlowchart', {
+        async deserializeWebviewPanel(panel: vscode.WebviewPanel, state: any) {
+            const stored = context.workspaceState.get<StoredFlowchart>(FLOWCHART_STATE_KEY);
+            if (!stored) {
+                console.warn('No stored flowchart for the restored panel, closing it');
+                panel.dispose();
+                return;
+            }
+            // webview 保存的視角若屬於較舊的圖，還原時會自動捨棄，圖一律以最近一次生成的為準
+            console.log('Restoring flowchart panel:', stored.sourceHash, 'webview state:', state?.sourceHash);
+            lastFlowchart = stored;
+
+            sourceDocUri = vscode.Uri.parse(stored.sourceUri);
+            notebookCells = stored.notebookCells ?? [];
+            notebookSource = stored.notebookSource ?? '';
+            lineToNodeMap = parseLineMapping(stored.lineMapping);
+            setExternalNodeTargets(parseNodeMeta(stored.nodeMeta ?? '{}'));
+            nodeOrder = stored.nodeOrder;
+
+            panel.webview.options = getWebviewOptions(context);
+            currentPanel = panel;
+            setupFlowchartPanel(panel, context);
+            panelOpenStart = Date.now();
+            flowchartReady = false;
+            pendingFlowchartMessages = [];
+
+            // 有保存的 SVG 時 webview 送出 webview.ready 後直接插入，不需要重新分析或 layout
+            panel.webview.html = await getWebviewHtmlExternal(
+                panel.webview,
+                context,
+                stored.mermaidCode,
+                nodeOrder,
+                getPseudocodeHistoryText(),
+                stored.sourceHash,
+                stored.metrics
+            );
+        }
+    });
+
     let generateDisposable = vscode.commands.registerCommand('m5-test2.generate', async () => {
-        const editor = vscode.window.activeTextEditor;
-        if (!editor) {
-            vscode.window.showErrorMessage('No active Python file');
+        const notebook = getActiveNotebook();
+        if (notebook) {
+            try {
+                await generateNotebookFlowchart(context, notebook);
+            } catch (error) {
+                vscode.window.showErrorMessage(`Error generating flowchart: ${error}`);
+            }
             return;
         }
 
-        const document = editor.document;
-        
-        if (document.languageId !== 'python') {
-            vscode.window.showErrorMessage('Current file is not a Python file');
+        const document = getActivePythonDocument();
+        if (!document) {
             return;
         }
 
         const code = document.getText();
-        sourceDocUri = editor.document.uri;
+        sourceDocUri = document.uri;
+        notebookCells = [];
+        scopedMode = false;
         
+        // 先開好 panel，分析途中送出的片段（主流程優先）就能逐步顯示
+        const streamId = ++flowchartStreamId;
+        streamStartTime = Date.now();
+        streamFirstPaint = false;
+        const panelCreated = await openFlowchartPanel(context);
+
         try {
-            const { mermaidCode, lineMapping, nodeSequence, nodeMeta } = await parsePythonWithAST(code);
-            
-            console.log('Generated Mermaid code:');
-            console.log(mermaidCode);
-            console.log('Line mapping:', lineMapping);
-            console.log('Node sequence:', nodeSequence);
+            const externalModules = (await getSymbolIndex(context)).resolveImports(code, document.uri);
+            const analysis = await parsePythonWithAST(code, externalModules, undefined, getMaxLabelLength(),
+                chunk => postFlowchartMessage({ command: 'flowchartChunk', streamId, chunk }), getParallelWorkers());
+            console.log(`Flowchart analysis finished in ${Date.now() - streamStartTime} ms`);
+            await showFlowchart(context, analysis, code, hashSource(code));
+        } catch (error) {
+            abandonFlowchartStream(panelCreated, streamId, String(error));
+            vscode.window.showErrorMessage(`Error generating flowchart: ${error}`);
+        }
+    });
 
-            pseudocodeHistory = [];
-            
-            let pseudocodeText = '等待生成 Pseudocode...';
-            
-            lineToNodeMap = parseLineMapping(lineMapping);
-            console.log('Parsed line to node map:', Array.from(lineToNodeMap.entries()));
-            
-            nodeOrder = await parseNodeSequence(nodeSequence, nodeMeta, code);
-            console.log('Node order:', nodeOrder);
-            
-            if (currentPanel) {
-                currentPanel.reveal(vscode.ViewColumn.Two);
-            } else {
-                currentPanel = vscode.window.createWebviewPanel(
-                    'pythonFlowchart',
-                    'Python Flowchart',
-                    vscode.ViewColumn.Two,
-                    {
-                        enableScripts: true,
-                        retainContextWhenHidden: true,
-                        localResourceRoots: [vscode.Uri.joinPath(context.extensionUri, 'media')],
-                    }
-                );
-
-                currentPanel.onDidDispose(() => {
-                    currentPanel = undefined;
-                    // setWebviewPanel(undefined);
-                    pseudocodeHistory = [];
-                    currentLineMapping = [];
-                    pseudocodeToLineMap.clear();
-                    fullPseudocodeGenerated = false;
-                });
-            }
+    const generateScopedDisposable = vscode.commands.registerCommand('m5-test2.generateScoped', async () => {
+        const document = getActivePythonDocument();
+        if (!document) {
+            return;
+        }
 
-            // 設置 webview panel 引用
-            // setWebviewPanel(currentPanel);
+        const line = vscode.window.activeTextEditor!.selection.active.line + 1;
+        scopedMode = true;
+        currentScopeStart = undefined;
+        notebookCells = [];
 
-            currentPanel.webview.html = await getWebviewHtmlExternal(
-                currentPanel.webview,
-                context,
-                mermaidCode,
-                nodeOrder,
-                getPseudocodeHistoryText()
-            );
-            
-            currentPanel.webview.onDidReceiveMessage(
-                message => {
-                    switch (message.command) {
-                        case 'webview.FlowchartNodeClicked':
-                            FlowchartNodeClickEventHandler(message);
-                            break;
-                        case 'webview.requestClearEditor':
-                            clearEditor(editor);
-                            break;
-                        case 'webview.clearPseudocodeHistory':
-                            pseudocodeHistory = [];
-                            currentLineMapping = [];
-                            pseudocodeToLineMap.clear();
-                            fullPseudocodeGenerated = false;
-                            updateWebviewPseudocode();
-                            break;
-                        case 'webview.pseudocodeLineClicked':
-                            handlePseudocodeLineClick(message.pseudocodeLine);
-                            break;
-                        case 'webview.pseudocodeLinesClicked':
-                            console.log('收到 webview.pseudocodeLinesClicked 消息:', message);
-                            handlePseudocodeLinesClick(message.pseudocodeLines);
-                            break;
-                    }
-                },
-                undefined,
-                context.subscriptions
-            );
-            
+        try {
+            await generateScopedFlowchart(context, document, line, true);
         } catch (error) {
             vscode.window.showErrorMessage(`Error generating flowchart: ${error}`);
         }
     });
 
+    // 範圍模式下，游標移到另一個函式時跟著切換流程圖
+    const scopeFollowDisposable = vscode.window.onDidChangeTextEditorSelection((e) => {
+        if (!scopedMode || !currentPanel || e.textEditor.document.uri.toString() !== sourceDocUri?.toString()) {
+            return;
+        }
+        if (scopeFollowTimeout) {
+            clearTimeout(scopeFollowTimeout);
+        }
+        const document = e.textEditor.document;
+        const line = e.selections[0].active.line + 1;
+        scopeFollowTimeout = setTimeout(() => {
+            scopeFollowTimeout = undefined;
+            generateScopedFlowchart(context, document, line, false)
+                .catch(error => console.error('Failed to follow cursor scope:', error));
+        }, SCOPE_FOLLOW_DELAY_MS);
+    });
+
     const clearHistoryDisposable = vscode.commands.registerCommand('code2pseudocode.clearHistory', () => {
         pseudocodeHistory = [];
         currentLineMapping = [];
         pseudocodeToLineMap.clear();
         fullPseudocodeGenerated = false;
+        llmPseudocodeGenerated = false;
         updateWebviewPseudocode();
         vscode.window.showInformationMessage('Pseudocode history cleared');
     });
@@ -175,7 +263,8 @@ export function activate(context: vscode.ExtensionContext) {
         if (!editor || editor.document.languageId !== 'python') {
             return;
         }
-        if (editor.document.uri !== sourceDocUri) {
+        const lineOffset = getFlowchartLineOffset(editor.document);
+        if (lineOffset === undefined) {
             console.error('current editor is not where the flowchart come from');
             return;
         }
@@ -184,8 +273,8 @@ export function activate(context: vscode.ExtensionContext) {
         clearEditor(editor);
         
         if (!selection.isEmpty) {
-            const startLine = selection.start.line + 1;
-            const endLine = selection.end.line + 1;
+            const startLine = selection.start.line + 1 + lineOffset;
+            const endLine = selection.end.line + 1 + lineOffset;
             
             console.log(`Selection from line ${startLine} to ${endLine}`);
             
@@ -208,7 +297,7 @@ export function activate(context: vscode.ExtensionContext) {
                 clearHighlightInWebviewPanel();
             }
         } else {
-            const lineNumber = selection.active.line + 1;
+            const lineNumber = selection.active.line + 1 + lineOffset;
             
             console.log('Cursor at line:', lineNumber);
             
@@ -224,9 +313,528 @@ export function activate(context: vscode.ExtensionContext) {
         }
     });
 
-    context.subscriptions.push(generateDisposable);
+    context.subscriptions.push(generateDisposable, generateScopedDisposable, serializerDisposable);
+    context.subscriptions.push(scopeFollowDisposable);
     context.subscriptions.push(selectionDisposable);
     context.subscriptions.push(disposable, onChangeDisposable, clearHistoryDisposable);
+    context.subscriptions.push(vscode.workspace.onDidCloseNotebookDocument(notebook => notebookCache.forget(notebook.uri)));
+
+    const activationTimeMs = Date.now() - activationStart;
+    console.log(`Extension activated in ${activationTimeMs} ms`);
+    if (activationTimeMs > ACTIVATION_BUDGET_MS) {
+        console.warn(`Activation took ${activationTimeMs} ms, over the ${ACTIVATION_BUDGET_MS} ms budget`);
+    }
+    // 測試以此確認啟動時沒有載入延後的部分（比量測時間穩定）
+    return {
+        activationTimeMs,
+        deferredState: () => ({
+            claudeApiLoaded: claudeApi !== undefined,
+            envLoaded,
+            symbolIndexStarted: symbolIndex !== undefined
+        })
+    };
+}
+
+// 第一次呼叫時建立索引並掃描工作區（之後的呼叫共用同一次掃描）；掃描失敗時仍可使用已載入的部分
+function getSymbolIndex(context: vscode.ExtensionContext): Promise<WorkspaceSymbolIndex> {
+    if (!symbolIndex) {
+        const index = new WorkspaceSymbolIndex(context);
+        context.subscriptions.push(index);
+        symbolIndex = index.initialize()
+            .catch(error => console.error('Failed to build symbol index:', error))
+            .then(() => index);
+    }
+    return symbolIndex;
+}
+
+// .env 與 Claude API 模組（axios）只在第一次需要時載入
+async function loadEnv(): Promise<void> {
+    if (envLoaded) {
+        return;
+    }
+    envLoaded = true;
+    const dotenv = await import('dotenv');
+    dotenv.config({ path: path.join(extensionPath, '.env') });
+    console.log('CLAUDE_API_KEY exists:', !!process.env.CLAUDE_API_KEY);
+}
+
+function loadClaudeApi(): Promise<typeof import('./claudeApi')> {
+    if (!claudeApi) {
+        const start = Date.now();
+        claudeApi = import('./claudeApi').then(module => {
+            console.log(`Claude API module loaded in ${Date.now() - start} ms`);
+            return module;
+        });
+    }
+    return claudeApi;
+}
+
+function getWebviewOptions(context: vscode.ExtensionContext): vscode.WebviewPanelOptions & vscode.WebviewOptions {
+    return {
+        enableScripts: true,
+        localResourceRoots: [vscode.Uri.joinPath(context.extensionUri, 'media')],
+    };
+}
+
+// 新建或還原的 panel 共用：dispose 清理與 webview 訊息 handler 只註冊一次
+function setupFlowchartPanel(panel: vscode.WebviewPanel, context: vscode.ExtensionContext) {
+    panel.onDidDispose(() => {
+        currentPanel = undefined;
+        scopedMode = false;
+        flowchartReady = false;
+        pendingFlowchartMessages = [];
+        // setWebviewPanel(undefined);
+        pseudocodeHistory = [];
+        currentLineMapping = [];
+        pseudocodeToLineMap.clear();
+        fullPseudocodeGenerated = false;
+        llmPseudocodeGenerated = false;
+    });
+
+    // 隱藏時 webview 被釋放，送過去的訊息會遺失；先排隊，等再次顯示、webview 重建後送出 webview.ready
+    panel.onDidChangeViewState(() => {
+        if (!panel.visible) {
+            flowchartReady = false;
+        }
+    }, undefined, context.subscriptions);
+
+    panel.webview.onDidReceiveMessage(
+        message => handleWebviewMessage(message, context),
+        undefined,
+        context.subscriptions
+    );
+}
+
+// 尚未開啟 panel 時先建立一個空的，讓串流片段有地方顯示；回傳是否為新建立的 panel
+async function openFlowchartPanel(context: vscode.ExtensionContext): Promise<boolean> {
+    if (currentPanel) {
+        currentPanel.reveal(vscode.ViewColumn.Two, scopedMode);
+        return false;
+    }
+    const panel = createFlowchartPanel(context, 'Python Flowchart');
+    panel.webview.html = await getWebviewHtmlExternal(panel.webview, context, '', [], getPseudocodeHistoryText());
+    return true;
+}
+
+// 先開好 panel 後分析失敗：為此新建的空白 panel 直接關閉，
+// 既有的 panel 則放棄串流預覽，繼續顯示原本的圖（沒有圖時在 panel 中顯示錯誤）
+function abandonFlowchartStream(panelCreated: boolean, streamId: number, reason: string) {
+    if (!currentPanel) {
+        return;
+    }
+    if (panelCreated) {
+        currentPanel.dispose();
+        return;
+    }
+    postFlowchartMessage({ command: 'flowchartError', streamId, message: reason });
+}
+
+function createFlowchartPanel(context: vscode.ExtensionContext, title: string): vscode.WebviewPanel {
+    // 不使用 retainContextWhenHidden：隱藏時釋放 webview，
+    // 再次顯示時由 webview 保存的狀態直接還原 SVG
+    const panel = vscode.window.createWebviewPanel(
+        'pythonFlowchart',
+        title,
+        { viewColumn: vscode.ViewColumn.Two, preserveFocus: scopedMode },
+        getWebviewOptions(context)
+    );
+    currentPanel = panel;
+    setupFlowchartPanel(panel, context);
+    panelOpenStart = Date.now();
+    flowchartReady = false;
+    pendingFlowchartMessages = [];
+    return panel;
+}
+
+function postFlowchartMessage(message: any) {
+    if (!currentPanel) {
+        return;
+    }
+    if (flowchartReady) {
+        currentPanel.webview.postMessage(message);
+    } else {
+        pendingFlowchartMessages.push(message);
+    }
+}
+
+function flushFlowchartMessages(): boolean {
+    if (panelOpenStart) {
+        const elapsed = Date.now() - panelOpenStart;
+        panelOpenStart = 0;
+        console.log(`Flowchart panel ready in ${elapsed} ms`);
+        if (elapsed > FIRST_PANEL_BUDGET_MS) {
+            console.warn(`Flowchart panel took ${elapsed} ms, over the ${FIRST_PANEL_BUDGET_MS} ms budget`);
+        }
+    }
+    flowchartReady = true;
+    const messages = pendingFlowchartMessages;
+    pendingFlowchartMessages = [];
+    messages.forEach(message => currentPanel?.webview.postMessage(message));
+    return messages.some(message => message.command === 'renderFlowchart' || message.command === 'flowchartChunk');
+}
+
+// webview 重建（panel 隱藏後再顯示、VS Code 重啟）或 HTML 中的圖已過時：送回最近一次生成的圖，
+// 已有渲染好的 SVG 時直接插入，否則重新渲染
+function restoreLastFlowchart(webviewSourceHash: string, restoring: boolean) {
+    if (!currentPanel || !lastFlowchart || (!restoring && webviewSourceHash === lastFlowchart.sourceHash)) {
+        return;
+    }
+    console.log('Restoring flowchart in webview:', lastFlowchart.sourceHash, lastFlowchart.svg ? '(saved SVG)' : '(re-render)');
+    if (lastFlowchart.svg) {
+        currentPanel.webview.postMessage({
+            command: 'restoreFlowchart',
+            svg: lastFlowchart.svg,
+            sourceHash: lastFlowchart.sourceHash,
+            nodeOrder: lastFlowchart.nodeOrder,
+            metrics: parseMetrics(lastFlowchart.metrics)
+        });
+    } else {
+        currentPanel.webview.postMessage({
+            command: 'renderFlowchart',
+            mermaidCode: lastFlowchart.mermaidCode,
+            nodeOrder: lastFlowchart.nodeOrder,
+            sourceHash: lastFlowchart.sourceHash,
+            metrics: parseMetrics(lastFlowchart.metrics)
+        });
+    }
+    updateWebviewPseudocode();
+}
+
+function reportPaintTiming(streamId: number, partial: boolean) {
+    if (streamId !== flowchartStreamId || !streamStartTime) {
+        return;
+    }
+    const elapsed = Date.now() - streamStartTime;
+    if (partial) {
+        if (!streamFirstPaint) {
+            streamFirstPaint = true;
+            console.log(`Flowchart time to first paint: ${elapsed} ms`);
+        }
+    } else {
+        console.log(`Flowchart complete paint: ${elapsed} ms${streamFirstPaint ? '' : ' (no partial paint)'}`);
+        streamStartTime = 0;
+    }
+}
+
+function hashSource(code: string): string {
+    return crypto.createHash('sha1').update(code).digest('hex');
+}
+
+function getMaxLabelLength(): number | undefined {
+    return vscode.workspace.getConfiguration('m5-test2').get<number>('maxLabelLength');
+}
+
+// 分析器照指定的行程數執行，這裡先限制在本機的核心數以內
+function getParallelWorkers(): number {
+    const workers = vscode.workspace.getConfiguration('m5-test2').get<number>('parallelWorkers', 0);
+    return Math.min(workers, os.cpus().length);
+}
+
+function isCompactPromptEnabled(): boolean {
+    return vscode.workspace.getConfiguration('m5-test2').get<boolean>('compactPrompt', true);
+}
+
+// 目前聚焦的是 Jupyter 筆記本（或其中的 cell）時回傳該筆記本
+function getActiveNotebook(): vscode.NotebookDocument | undefined {
+    const notebook = vscode.window.activeNotebookEditor?.notebook;
+    if (!notebook || notebook.notebookType !== 'jupyter-notebook') {
+        return undefined;
+    }
+    const editor = vscode.window.activeTextEditor;
+    if (editor && editor.document.uri.scheme !== 'vscode-notebook-cell') {
+        return undefined;
+    }
+    return notebook;
+}
+
+// 編輯器行號加上此值即為流程圖行號；文件不屬於目前的流程圖時回傳 undefined
+export function getFlowchartLineOffset(document: vscode.TextDocument): number | undefined {
+    const uri = document.uri.toString();
+    if (notebookCells.length > 0) {
+        return notebookCells.find(span => span.uri === uri)?.offset;
+    }
+    return uri === sourceDocUri?.toString() ? 0 : undefined;
+}
+
+// 流程圖行號 -> 所在文件（筆記本則為對應的 cell）與文件內的行號
+export function getSourceLocation(line: number): { uri: vscode.Uri, line: number } | undefined {
+    if (notebookCells.length > 0) {
+        const span = findCellSpan(notebookCells, line);
+        return span ? { uri: vscode.Uri.parse(span.uri), line: line - span.offset } : undefined;
+    }
+    return sourceDocUri ? { uri: sourceDocUri, line } : undefined;
+}
+
+// 筆記本：只重新分析內容改變的 cell，其餘沿用快取，再依執行順序接成一張圖
+async function generateNotebookFlowchart(context: vscode.ExtensionContext, notebook: vscode.NotebookDocument) {
+    sourceDocUri = notebook.uri;
+    notebookCells = [];
+    scopedMode = false;
+    const streamId = ++flowchartStreamId;
+    streamStartTime = Date.now();
+    streamFirstPaint = false;
+    const panelCreated = await openFlowchartPanel(context);
+
+    const maxLabelLength = getMaxLabelLength();
+    let result;
+    try {
+        const index = await getSymbolIndex(context);
+        result = await notebookCache.analyze(notebook, String(maxLabelLength ?? ''),
+            code => index.resolveImports(code, notebook.uri),
+            (code, externalModules) => parsePythonWithAST(code, externalModules, undefined, maxLabelLength));
+    } catch (error) {
+        abandonFlowchartStream(panelCreated, streamId, String(error));
+        throw error;
+    }
+    console.log(`Notebook flowchart: ${result.cells.length} cells, ${result.reanalyzed} re-analyzed in ${Date.now() - streamStartTime} ms`);
+
+    if (result.cells.length === 0) {
+        abandonFlowchartStream(panelCreated, streamId, '筆記本中沒有 Python code cell');
+        vscode.window.showInformationMessage('筆記本中沒有 Python code cell');
+        return;
+    }
+    if (result.failed.length > 0) {
+        vscode.window.showWarningMessage(`以下 cell 無法解析，流程圖中只顯示標題：${result.failed.join(', ')}`);
+    }
+
+    notebookCells = result.cells;
+    notebookSource = result.source;
+    await showFlowchart(context, result.analysis, result.source, hashSource(result.source),
+        `Python Flowchart: ${path.basename(notebook.uri.fsPath)}`);
+}
+
+function getActivePythonDocument(): vscode.TextDocument | undefined {
+    const editor = vscode.window.activeTextEditor;
+    if (!editor) {
+        vscode.window.showErrorMessage('No active Python file');
+        return undefined;
+    }
+    if (editor.document.languageId !== 'python') {
+        vscode.window.showErrorMessage('Current file is not a Python file');
+        return undefined;
+    }
+    return editor.document;
+}
+
+// 範圍可以巢狀（類別中的方法、函式中的函式），取起始行最大者即最內層
+function findEnclosingScope(spans: ScopeSpan[], line: number): ScopeSpan | undefined {
+    let best: ScopeSpan | undefined;
+    for (const span of spans) {
+        if (span.start <= line && line <= span.end && (!best || span.start > best.start)) {
+            best = span;
+        }
+    }
+    return best;
+}
+
+async function generateScopedFlowchart(
+    context: vscode.ExtensionContext,
+    document: vscode.TextDocument,
+    line: number,
+    explicit: boolean
+) {
+    const code = document.getText();
+    const sourceHash = hashSource(code);
+    if (sourceHash !== scopeSourceHash || document.uri.toString() !== sourceDocUri?.toString()) {
+        scopeCache.clear();
+        scopeSpans = [];
+        scopeSourceHash = sourceHash;
+        currentScopeStart = undefined;
+    }
+
+    // 已知各函式範圍時直接在這裡判斷，游標仍在同一個範圍內就不重畫
+    let span = findEnclosingScope(scopeSpans, line);
+    if (scopeSpans.length > 0 && !span) {
+        if (explicit) {
+            vscode.window.showInformationMessage('游標不在任何函式或類別內');
+        }
+        return;
+    }
+    if (span && span.start === currentScopeStart) {
+        return;
+    }
+
+    const request = ++scopeRequest;
+    let analysis = span ? scopeCache.get(span.start) : undefined;
+    if (!analysis) {
+        const externalModules = (await getSymbolIndex(context)).resolveImports(code, document.uri);
+        analysis = await parsePythonWithAST(code, externalModules, line, getMaxLabelLength());
+
+        let scopeInfo: { scope: ScopeSpan | null, scopes: ScopeSpan[] };
+        try {
+            scopeInfo = JSON.parse(analysis.scopeInfo);
+        } catch (e) {
+            console.error('Error parsing scope info:', e);
+            return;
+        }
+        scopeSpans = scopeInfo.scopes;
+        if (!scopeInfo.scope) {
+            if (explicit) {
+                vscode.window.showInformationMessage('游標不在任何函式或類別內');
+            }
+            return;
+        }
+        span = scopeInfo.scope;
+        scopeCache.set(span.start, analysis);
+    }
+
+    // 分析期間游標已經移到別的範圍，較新的請求會負責顯示
+    if (request !== scopeRequest) {
+        return;
+    }
+
+    console.log(`Scoped flowchart: ${span.name} (lines ${span.start}-${span.end})`);
+    sourceDocUri = document.uri;
+    currentScopeStart = span.start;
+    await showFlowchart(context, analysis, code, `${sourceHash}:${span.start}`, `Python Flowchart: ${span.name}`);
+}
+
+// 顯示分析結果：更新行號與節點對應、保存狀態，重用或建立 webview panel
+async function showFlowchart(
+    context: vscode.ExtensionContext,
+    analysis: FlowchartAnalysis,
+    code: string,
+    sourceHash: string,
+    title: string = 'Python Flowchart'
+) {
+    const { mermaidCode, lineMapping, nodeSequence, nodeMeta, metrics } = analysis;
+
+    console.log('Generated Mermaid code:');
+    console.log(mermaidCode);
+    console.log('Line mapping:', lineMapping);
+    console.log('Node sequence:', nodeSequence);
+
+    // 本地規則產生的 pseudocode 立即顯示；同一份程式碼已有 Claude 的版本時則保留
+    localPseudocode = { sourceHash: hashSource(code), pseudocode: analysis.pseudocode };
+    if (!llmPseudocodeGenerated || llmPseudocodeHash !== hashSource(code)) {
+        applyPseudocodeResult(parsePseudocodeResult(analysis.pseudocode));
+        llmPseudocodeGenerated = false;
+    }
+
+    lineToNodeMap = parseLineMapping(lineMapping);
+    console.log('Parsed line to node map:', Array.from(lineToNodeMap.entries()));
+    setExternalNodeTargets(parseNodeMeta(nodeMeta));
+
+    nodeOrder = await parseNodeSequence(nodeSequence, nodeMeta, code);
+    console.log('Node order:', nodeOrder);
+
+    const stored: StoredFlowchart = {
+        sourceHash,
+        sourceUri: sourceDocUri!.toString(),
+        mermaidCode,
+        lineMapping,
+        nodeOrder,
+        nodeMeta,
+        metrics,
+        notebookCells: notebookCells.length > 0 ? notebookCells : undefined,
+        notebookSource: notebookCells.length > 0 ? notebookSource : undefined,
+        scoped: scopedMode || undefined
+    };
+    lastFlowchart = stored;
+    if (!stored.scoped) {
+        // 存副本，之後回報的 SVG 只加在記憶體中的 lastFlowchart 上
+        await context.workspaceState.update(FLOWCHART_STATE_KEY, { ...stored });
+    }
+
+    if (currentPanel) {
+        currentPanel.title = title;
+        currentPanel.reveal(vscode.ViewColumn.Two, scopedMode);
+
+        // 重用既有 webview：只送出新的圖，webview 會放棄仍在進行中的舊渲染與串流預覽
+        postFlowchartMessage({
+            command: 'renderFlowchart',
+            mermaidCode,
+            nodeOrder,
+            sourceHash,
+            streamId: flowchartStreamId,
+            metrics: parseMetrics(metrics)
+        });
+        updateWebviewPseudocode();
+    } else {
+        const panel = createFlowchartPanel(context, title);
+        panel.webview.html = await getWebviewHtmlExternal(
+            panel.webview,
+            context,
+            mermaidCode,
+            nodeOrder,
+            getPseudocodeHistoryText(),
+            sourceHash,
+            metrics
+        );
+    }
+}
+
+// webview 訊息只在建立 panel 時註冊一次，之後重新生成的圖沿用同一個 handler
+function handleWebviewMessage(message: any, context: vscode.ExtensionContext) {
+    switch (message.command) {
+        case 'webview.FlowchartNodeClicked':
+            FlowchartNodeClickEventHandler(message);
+            break;
+        case 'webview.requestClearEditor':
+            clearEditor(findSourceEditor());
+            break;
+        case 'webview.clearPseudocodeHistory':
+            pseudocodeHistory = [];
+            currentLineMapping = [];
+            pseudocodeToLineMap.clear();
+            fullPseudocodeGenerated = false;
+            llmPseudocodeGenerated = false;
+            updateWebviewPseudocode();
+            break;
+        case 'webview.pseudocodeLineClicked':
+            handlePseudocodeLineClick(message.pseudocodeLine);
+            break;
+        case 'webview.metricsRowClicked':
+            revealSourceLine(message.line);
+            break;
+        case 'webview.ready':
+            // 排隊中已有新的圖時以新的為準，不必還原
+            if (!flushFlowchartMessages()) {
+                restoreLastFlowchart(message.sourceHash ?? '', !!message.restoring);
+            }
+            break;
+        case 'webview.requestFlowchart':
+            // 失敗的串流預覽已蓋掉原本的圖
+            restoreLastFlowchart(message.sourceHash ?? '', true);
+            break;
+        case 'webview.flowchartSvg':
+            // 每次完整渲染只回報一次；只保存目前這張圖的 SVG，範圍圖與過大的 SVG 不寫入 workspaceState
+            if (lastFlowchart && message.sourceHash === lastFlowchart.sourceHash) {
+                lastFlowchart.svg = message.svg;
+                if (!lastFlowchart.scoped && message.svg.length <= MAX_STORED_SVG_LENGTH) {
+                    context.workspaceState.update(FLOWCHART_STATE_KEY, { ...lastFlowchart });
+                } else {
+                    console.log('Flowchart SVG kept in memory only:', lastFlowchart.scoped ? 'scoped render' : `${message.svg.length} chars`);
+                }
+            }
+            break;
+        case 'webview.flowchartPainted':
+            reportPaintTiming(message.streamId, message.partial);
+            break;
+        case 'webview.pseudocodeLinesClicked':
+            console.log('收到 webview.pseudocodeLinesClicked 消息:', message);
+            handlePseudocodeLinesClick(message.pseudocodeLines);
+            break;
+    }
+}
+
+// 靜態效能指標摘要表的一列被點擊：跳到該函式的定義
+function revealSourceLine(line: number) {
+    const location = line ? getSourceLocation(line) : undefined;
+    if (!location) {
+        return;
+    }
+    vscode.window.showTextDocument(location.uri, { viewColumn: vscode.ViewColumn.One }).then(editor => {
+        const position = new vscode.Position(location.line - 1, 0);
+        editor.selection = new vscode.Selection(position, position);
+        editor.revealRange(new vscode.Range(position, position), vscode.TextEditorRevealType.InCenter);
+    });
+}
+
+function findSourceEditor(): vscode.TextEditor | undefined {
+    return vscode.window.visibleTextEditors.find(
+        (e) => getFlowchartLineOffset(e.document) !== undefined
+    );
 }
 
 function handlePseudocodeLinesClick(pseudocodeLines: number[]) {
@@ -287,13 +895,21 @@ function handlePseudocodeLinesClick(pseudocodeLines: number[]) {
     
     //找到最小和最大的 Python 行號
     const sortedLines = Array.from(pythonLines).sort((a, b) => a - b);
-    const startLine = sortedLines[0] - 1; // VS Code 使用 0-based index
-    const endLine = sortedLines[sortedLines.length - 1] - 1;
+    // 筆記本的行號換回 cell 內的行號；跨越多個 cell 時只選取第一個 cell 中的部分
+    const first = getSourceLocation(sortedLines[0]);
+    if (!first) {
+        console.error('找不到行號所在的 cell:', sortedLines[0]);
+        return;
+    }
+    const sameCell = sortedLines.filter(line => getSourceLocation(line)?.uri.toString() === first.uri.toString());
+    const lineOffset = sortedLines[0] - first.line;
+    const startLine = first.line - 1; // VS Code 使用 0-based index
+    const endLine = sameCell[sameCell.length - 1] - lineOffset - 1;
     
     console.log('選取範圍: 行', startLine, '到', endLine, '(0-based)');
     
-    //使用 sourceDocUri 打開文檔並設置選取
-    vscode.window.showTextDocument(sourceDocUri, {
+    //使用 sourceDocUri（筆記本則為 cell）打開文檔並設置選取
+    vscode.window.showTextDocument(first.uri, {
         viewColumn: vscode.ViewColumn.One,
         preserveFocus: false  // 將焦點移到編輯器
     }).then(editor => {
@@ -337,6 +953,24 @@ function handlePseudocodeLinesClick(pseudocodeLines: number[]) {
         vscode.window.showErrorMessage('無法打開源文件: ' + error);
     });
 }
+// 本地規則或 Claude 產生的結果共用：更新顯示文字與 pseudocode 行 -> Python 行的對應
+function applyPseudocodeResult(result: PseudocodeResult) {
+    currentLineMapping = result.lineMapping;
+    pseudocodeToLineMap.clear();
+    result.lineMapping.forEach(mapping => {
+        pseudocodeToLineMap.set(mapping.pseudocodeLine, mapping.pythonLine);
+    });
+
+    pseudocodeHistory = [];
+    addToPseudocodeHistory(result.pseudocode);
+    fullPseudocodeGenerated = true;
+}
+
+function parsePseudocodeResult(resultStr: string): PseudocodeResult {
+    try { return JSON.parse(resultStr) as PseudocodeResult; }
+    catch (e) { console.error('Error parsing local pseudocode:', e); return { pseudocode: '', lineMapping: [] }; }
+}
+
 function addToPseudocodeHistory(pseudocode: string) {
     pseudocodeHistory.push(pseudocode);
     const maxHistory = 50;
@@ -354,13 +988,13 @@ function getPseudocodeHistoryText(): string {
 
 function updateWebviewPseudocode() {
     if (currentPanel) {
-        currentPanel.webview.postMessage({
+        postFlowchartMessage({
             command: 'updatePseudocode',
             pseudocode: getPseudocodeHistoryText()
         });
         
         if (currentLineMapping.length > 0) {
-            currentPanel.webview.postMessage({
+            postFlowchartMessage({
                 command: 'setLineMapping',
                 mapping: currentLineMapping
             });
@@ -370,8 +1004,9 @@ function updateWebviewPseudocode() {
 
 
 
+// 筆記本合併圖中各 cell 的標題節點為 cellN_Start
 export function nodeIdStringIsStartOrEnd(nodeId: string): Boolean {
-    return nodeId === "Start" || nodeId === "End";
+    return nodeId === "Start" || nodeId === "End" || /^cell\d+_Start$/.test(nodeId);
 }
 
 function parseLineMapping(mappingStr: string): Map<number, string[]> {
@@ -411,7 +1046,8 @@ async function parseNodeSequence(sequenceStr: string, nodeMeta: string, fullCode
 type NodeMeta = Record<string, { 
     label: string;
     escaped_label: string; 
-    line: number | null 
+    line: number | null;
+    file?: string           // only for external function nodes
 }>;
 
 function parseNodeMeta(metaStr: string): NodeMeta {
@@ -419,6 +1055,33 @@ function parseNodeMeta(metaStr: string): NodeMeta {
     catch (e) { console.error('Error parsing node meta:', e); return {}; }
 }
 
+interface FlowchartMetrics {
+    functions: Array<{
+        name: string;
+        nodeId: string | null;
+        line: number;
+        complexity: number;
+        maxLoopDepth: number;
+        order: number;
+        loopCalls: Array<{ call: string, line: number, local: boolean }>;
+    }>;
+    loops: Array<{ nodeId: string, line: number, depth: number, order: number }>;
+}
+
+function parseMetrics(metricsStr: string | undefined): FlowchartMetrics {
+    try { return metricsStr ? JSON.parse(metricsStr) as FlowchartMetrics : { functions: [], loops: [] }; }
+    catch (e) { console.error('Error parsing metrics:', e); return { functions: [], loops: [] }; }
+}
+
+function setExternalNodeTargets(meta: NodeMeta) {
+    externalNodeTargets.clear();
+    for (const [nodeId, info] of Object.entries(meta)) {
+        if (info.file && info.line) {
+            externalNodeTargets.set(nodeId, { file: info.file, line: info.line });
+        }
+    }
+}
+
 function getNonce(): string {
     const chars = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789';
     let nonce = '';
@@ -428,30 +1091,43 @@ function getNonce(): string {
     return nonce;
 }
 
+let webviewTemplate: string | undefined;
+
 async function getWebviewHtmlExternal(
     webview: vscode.Webview,
     context: vscode.ExtensionContext,
     mermaidCode: string,
     nodeOrder: string[],
-    pseudocode: string = ''
+    pseudocode: string = '',
+    sourceHash: string = '',
+    metrics: string = ''
 ): Promise<string> {
-    const templateUri = vscode.Uri.joinPath(context.extensionUri, 'media', 'flowview.html');
-    const bytes = await vscode.workspace.fs.readFile(templateUri);
-    let html = new TextDecoder('utf-8').decode(bytes);
+    // 範本只讀一次，之後每次開啟或還原 panel 都直接使用
+    if (webviewTemplate === undefined) {
+        const templateUri = vscode.Uri.joinPath(context.extensionUri, 'media', 'flowview.html');
+        const bytes = await vscode.workspace.fs.readFile(templateUri);
+        webviewTemplate = new TextDecoder('utf-8').decode(bytes);
+    }
+    let html = webviewTemplate;
 
     const mermaidUri = webview.asWebviewUri(
         vscode.Uri.joinPath(context.extensionUri, 'media', 'mermaid.min.js')
     );
     console.log('Mermaid URI:', mermaidUri.toString());
     const nonce = getNonce();
+    // 呼叫名稱可能含任意原始碼片段：跳脫 < 避免 </script> 提前結束 JSON 區塊
+    const metricsJson = JSON.stringify(parseMetrics(metrics)).replace(/</g, '\\u003c');
 
+    // 一律以函式取代：標籤或 pseudocode 中的 $&、$' 等不會被當成替換樣式展開
     html = html
-        .replace(/%%CSP_SOURCE%%/g, webview.cspSource)
-        .replace(/%%NONCE%%/g, nonce)
-        .replace(/%%MERMAID_JS_URI%%/g, mermaidUri.toString())
-        .replace(/%%MERMAID_CODE%%/g, mermaidCode)
-        .replace(/%%NODE_ORDER_JSON%%/g, JSON.stringify(nodeOrder))
-        .replace(/%%PSEUDOCODE%%/g, escapeHtml(pseudocode)); 
+        .replace(/%%CSP_SOURCE%%/g, () => webview.cspSource)
+        .replace(/%%NONCE%%/g, () => nonce)
+        .replace(/%%SOURCE_HASH%%/g, () => sourceHash)
+        .replace(/%%MERMAID_JS_URI%%/g, () => mermaidUri.toString())
+        .replace(/%%MERMAID_CODE%%/g, () => mermaidCode)
+        .replace(/%%NODE_ORDER_JSON%%/g, () => JSON.stringify(nodeOrder))
+        .replace(/%%METRICS_JSON%%/g, () => metricsJson)
+        .replace(/%%PSEUDOCODE%%/g, () => escapeHtml(pseudocode)); 
 
     return html;
 }
@@ -470,23 +1146,45 @@ async function convertToPseudocode(isAutoUpdate: boolean = false) {
         return;
     }
 
-    if (fullPseudocodeGenerated) {
+    if (llmPseudocodeGenerated) {
         vscode.window.showInformationMessage('Pseudocode 已生成，使用現有映射');
         return;
     }
 
+    // 筆記本送出串接後的 cell 內容，行號與合併圖一致
     const document = editor.document;
-    const fullCode = document.getText();
+    const fullCode = notebookCells.length > 0 && getFlowchartLineOffset(document) !== undefined
+        ? notebookSource
+        : document.getText();
 
     if (!fullCode.trim()) {
         vscode.window.showErrorMessage('檔案內容為空');
         return;
     }
 
+    // 程式碼變動後本地版本已失效：先重新產生並顯示（只跑 pseudocode，不重建流程圖），Claude 的結果回來後再取代
+    if (!fullPseudocodeGenerated) {
+        try {
+            const sourceHash = hashSource(fullCode);
+            const pseudocode = localPseudocode?.sourceHash === sourceHash
+                ? localPseudocode.pseudocode
+                : await generateLocalPseudocode(fullCode);
+            applyPseudocodeResult(parsePseudocodeResult(pseudocode));
+            updateWebviewPseudocode();
+        } catch (error) {
+            console.error('本地 pseudocode 產生失敗:', error);
+        }
+    }
+
+    await loadEnv();
     const apiKey = process.env.CLAUDE_API_KEY;
     if (!apiKey) {
         if (!isAutoUpdate) {
-            vscode.window.showErrorMessage('找不到 CLAUDE_API_KEY，請檢查 .env 檔案');
+            if (fullPseudocodeGenerated) {
+                vscode.window.showInformationMessage('找不到 CLAUDE_API_KEY，使用本地規則產生的 pseudocode');
+            } else {
+                vscode.window.showErrorMessage('找不到 CLAUDE_API_KEY，請檢查 .env 檔案');
+            }
         }
         return;
     }
@@ -499,28 +1197,32 @@ async function convertToPseudocode(isAutoUpdate: boolean = false) {
         try {
             progress.report({ increment: 30, message: "正在呼叫 Claude API..." });
             
-            const result: PseudocodeResult = await codeToPseudocode(fullCode);
+            const { codeToPseudocode } = await loadClaudeApi();
+            // 精簡提示詞：送出帶行號的 AST 骨架，骨架產生失敗時退回完整原始碼
+            let skeleton: PromptSkeleton | undefined;
+            if (isCompactPromptEnabled()) {
+                try {
+                    skeleton = await generatePromptSkeleton(fullCode);
+                    console.log(`Prompt skeleton: ${skeleton.skeleton.length} chars (source ${fullCode.length} chars)`);
+                } catch (error) {
+                    console.error('程式骨架產生失敗，改送完整原始碼:', error);
+                }
+            }
+            const result: PseudocodeResult = await codeToPseudocode(fullCode, skeleton);
             
             progress.report({ increment: 40, message: "正在處理結果..." });
             
             console.log('Received line mapping:', result.lineMapping);
             console.log('Pseudocode lines:', result.pseudocode.split('\n').length);
             
-            currentLineMapping = result.lineMapping;
-
-            pseudocodeToLineMap.clear();
-            result.lineMapping.forEach(mapping => {
-                pseudocodeToLineMap.set(mapping.pseudocodeLine, mapping.pythonLine);
-            });
+            applyPseudocodeResult(result);
+            llmPseudocodeGenerated = true;
+            llmPseudocodeHash = hashSource(fullCode);
             console.log('Pseudocode to line map created:', Array.from(pseudocodeToLineMap.entries()));
             
             // 設置映射到 WebviewEventHandler
             // setMappings(pseudocodeToLineMap, lineToNodeMap);
             
-            pseudocodeHistory = [];
-            addToPseudocodeHistory(result.pseudocode);
-            fullPseudocodeGenerated = true;
-            
             updateWebviewPseudocode();
             
             progress.report({ increment: 30, message: "完成！" });
@@ -0,0 +1,284 @@
+import * as vscode from 'vscode';
+import * as crypto from 'crypto';
+import { FlowchartAnalysis } from './pythonAnalyzer';
+import { ExternalModules } from './symbolIndex';
+
+/**
+ * code cell 在合併圖中的位置：各 cell 依合併順序串接成一份虛擬文件，
+ * 合併圖的行號 = offset + cell 內的行號
+ */
+export interface NotebookCellSpan {
+    uri: string;
+    offset: number;
+    lineCount: number;
+}
+
+/**
+ * 整本筆記本的分析結果；source 為串接後的 cell 內容，行號與合併圖一致
+ */
+export interface NotebookAnalysis {
+    analysis: FlowchartAnalysis;
+    cells: NotebookCellSpan[];
+    source: string;
+    reanalyzed: number;
+    failed: string[];
+}
+
+export interface CellPart {
+    label: string;
+    offset: number;
+    analysis: FlowchartAnalysis | null;
+}
+
+interface CellMetrics {
+    functions: Array<{ name: string, nodeId: string | null, line: number, loopCalls: Array<{ line: number }> }>;
+    loops: Array<{ nodeId: string, line: number }>;
+}
+
+const NOTEBOOK_ANALYSIS_CONCURRENCY = 4;
+
+// IPython 的 %magic 與 !shell 行改成註解，行數不變，其餘內容照常交給 ast 解析
+const MAGIC_LINE = /^(\s*)(?=%{1,2}[A-Za-z]|!)/gm;
+
+// 節點 ID（Start / End / nodeN / func_名稱 / ext_N）；引號內的節點標籤與 |邊標籤| 整段跳過
+const MERMAID_TOKEN = /"[^"]*"|\|[^|"]*\||\b(?:Start|End|node\d+|func_\w+|ext_\d+)\b/g;
+const CLASS_LINE = /^class (\S+) (\w+)$/;
+
+/**
+ * Jupyter 筆記本的逐 cell 分析快取
+ *
+ * 每個 code cell 是一個分析單位，結果以 cell 內容的雜湊為 key 保存；
+ * 重新產生時只分析內容改變的 cell，再把各 cell 的圖依執行順序接成一張。
+ */
+export class NotebookAnalysisCache {
+
+    // 筆記本 URI -> cell 雜湊 -> 分析結果（null 表示該 cell 無法解析）
+    private entries = new Map<string, Map<string, FlowchartAnalysis | null>>();
+
+    /**
+     * contextKey：影響分析結果的設定（如節點標籤長度），改變時所有 cell 重新分析；
+     * resolveModules：cell 所 import 的工作區模組，一併算進該 cell 的雜湊，被 import 的檔案改變時重新分析
+     */
+    public async analyze(
+        notebook: vscode.NotebookDocument,
+        contextKey: string,
+        resolveModules: (code: string) => ExternalModules,
+        analyzeCell: (code: string, externalModules: ExternalModules) => Promise<FlowchartAnalysis>
+    ): Promise<NotebookAnalysis> {
+        const notebookKey = notebook.uri.toString();
+        const previous = this.entries.get(notebookKey) ?? new Map<string, FlowchartAnalysis | null>();
+        const current = new Map<string, FlowchartAnalysis | null>();
+
+        const cells = orderCells(notebook);
+        const sources = cells.map(cell => cell.document.getText().replace(MAGIC_LINE, '$1#'));
+        const modules = sources.map(resolveModules);
+        const keys = sources.map((source, index) => hashCell(contextKey, JSON.stringify(modules[index]), source));
+
+        // 內容相同的 cell 共用同一份結果，快取中已有的不再分析
+        const pending = [...new Set(keys)].filter(key => !previous.has(key));
+        await runLimited(pending, NOTEBOOK_ANALYSIS_CONCURRENCY, async key => {
+            const index = keys.indexOf(key);
+            try {
+                current.set(key, await analyzeCell(sources[index], modules[index]));
+            } catch (error) {
+                console.error('Failed to analyze notebook cell:', error);
+                current.set(key, null);
+            }
+        });
+        for (const key of keys) {
+            if (!current.has(key)) {
+                current.set(key, previous.get(key) ?? null);
+            }
+        }
+        // 只保留目前內容的結果，編輯過的舊版本一併丟棄
+        this.entries.set(notebookKey, current);
+
+        const spans: NotebookCellSpan[] = [];
+        const parts: CellPart[] = [];
+        const failed: string[] = [];
+        let offset = 0;
+        cells.forEach((cell, index) => {
+            const label = cellLabel(cell);
+            const analysis = current.get(keys[index]) ?? null;
+            if (!analysis) {
+                failed.push(label);
+            }
+            const lineCount = sources[index].split('\n').length;
+            spans.push({ uri: cell.document.uri.toString(), offset, lineCount });
+            parts.push({ label, offset, analysis });
+            offset += lineCount;
+        });
+
+        return {
+            analysis: joinCellAnalyses(parts),
+            cells: spans,
+            source: sources.join('\n'),
+            reanalyzed: pending.length,
+            failed
+        };
+    }
+
+    public forget(notebookUri: vscode.Uri): void {
+        this.entries.delete(notebookUri.toString());
+    }
+}
+
+/**
+ * 合併圖的行號落在哪個 cell
+ */
+export function findCellSpan(cells: NotebookCellSpan[], line: number): NotebookCellSpan | undefined {
+    return cells.find(span => span.offset < line && line <= span.offset + span.lineCount);
+}
+
+/**
+ * 非空的 Python code cell；每個 cell 都執行過時依執行順序，否則依筆記本中的順序（即 Run All 的順序）
+ */
+function orderCells(notebook: vscode.NotebookDocument): vscode.NotebookCell[] {
+    const cells = notebook.getCells().filter(cell =>
+        cell.kind === vscode.NotebookCellKind.Code
+        && cell.document.languageId === 'python'
+        && cell.document.getText().trim() !== '');
+
+    if (cells.length > 0 && cells.every(cell => cell.executionSummary?.executionOrder !== undefined)) {
+        return [...cells].sort((a, b) => a.executionSummary!.executionOrder! - b.executionSummary!.executionOrder!);
+    }
+    return cells;
+}
+
+function cellLabel(cell: vscode.NotebookCell): string {
+    const executionOrder = cell.executionSummary?.executionOrder;
+    return executionOrder !== undefined ? `Cell ${cell.index + 1} [${executionOrder}]` : `Cell ${cell.index + 1}`;
+}
+
+function hashCell(contextKey: string, modulesKey: string, source: string): string {
+    return crypto.createHash('sha1')
+        .update(contextKey).update('\0')
+        .update(modulesKey).update('\0')
+        .update(source)
+        .digest('hex');
+}
+
+async function runLimited<T>(items: T[], limit: number, task: (item: T) => Promise<void>): Promise<void> {
+    let next = 0;
+    const worker = async () => {
+        while (next < items.length) {
+            await task(items[next++]);
+        }
+    };
+    await Promise.all(Array.from({ length: Math.min(limit, items.length) }, worker));
+}
+
+/**
+ * 把各 cell 的圖接成一張：節點 ID 加上 cellN_ 前綴，每個 cell 的 Start 改成該 cell 的標題節點，
+ * 前一個 cell 的 End 直接接到下一個 cell 的標題，只有最後一個 cell 保留 End；
+ * 行號一律加上 cell 的 offset，換成合併圖的行號
+ */
+export function joinCellAnalyses(parts: CellPart[]): FlowchartAnalysis {
+    const mermaidLines = ['flowchart TD'];
+    const classDefs = new Set<string>();
+    const lineMapping: Record<string, string[]> = {};
+    const nodeSequence: string[] = [];
+    const nodeMeta: Record<string, any> = {};
+    const metrics: CellMetrics = { functions: [], loops: [] };
+    const pseudocodeParts: string[] = [];
+    const pseudocodeMapping: Array<{ pythonLine: number, pseudocodeLine: number }> = [];
+    let pseudocodeOffset = 0;
+
+    parts.forEach((part, index) => {
+        const prefix = `cell${index + 1}_`;
+        const last = index === parts.length - 1;
+        const next = last ? 'End' : `cell${index + 2}_Start`;
+        const rename = (id: string) => id === 'End' ? next : prefix + id;
+        const header = rename('Start');
+        const keep = (id: string) => id !== 'End' || last;
+
+        if (!part.analysis) {
+            // 無法解析的 cell 只畫標題節點，流程照樣接到下一個 cell
+            mermaidLines.push(`    ${header}(["${part.label} (syntax error)"])`);
+            if (!last) {
+                mermaidLines.push(`    ${header} --> ${next}`);
+            }
+            nodeSequence.push(header);
+            return;
+        }
+        const analysis = part.analysis;
+
+        for (const line of analysis.mermaidCode.split('\n').slice(1)) {
+            const trimmed = line.trim();
+            if (trimmed === 'Start([Start])') {
+                mermaidLines.push(`    ${header}(["${part.label}"])`);
+            } else if (trimmed === 'End([End])') {
+                if (last) {
+                    mermaidLines.push(line);
+                }
+            } else if (trimmed.startsWith('classDef ')) {
+                if (!classDefs.has(trimmed)) {
+                    classDefs.add(trimmed);
+                    mermaidLines.push(line);
+                }
+            } else if (CLASS_LINE.test(trimmed)) {
+                const [, ids, className] = CLASS_LINE.exec(trimmed)!;
+                const renamed = ids.split(',').filter(keep).map(rename);
+                if (renamed.length > 0) {
+                    mermaidLines.push(`    class ${renamed.join(',')} ${className}`);
+                }
+            } else {
+                mermaidLines.push(line.replace(MERMAID_TOKEN, token => /^["|]/.test(token) ? token : rename(token)));
+            }
+        }
+
+        for (const [line, ids] of Object.entries(parseJson<Record<string, string[]>>(analysis.lineMapping, {}))) {
+            lineMapping[String(part.offset + Number(line))] = ids.map(rename);
+        }
+        nodeSequence.push(...parseJson<string[]>(analysis.nodeSequence, []).filter(keep).map(rename));
+
+        for (const [id, meta] of Object.entries(parseJson<Record<string, any>>(analysis.nodeMeta, {}))) {
+            // 外部函式節點的行號屬於另一個檔案，不需位移
+            nodeMeta[rename(id)] = meta.file || meta.line === null ? meta : { ...meta, line: meta.line + part.offset };
+        }
+
+        const cellMetrics = parseJson<CellMetrics>(analysis.metrics, { functions: [], loops: [] });
+        cellMetrics.functions.forEach(fn => metrics.functions.push({
+            ...fn,
+            name: fn.name === '<module>' ? part.label : fn.name,
+            nodeId: fn.nodeId && rename(fn.nodeId),
+            line: fn.line + part.offset,
+            loopCalls: fn.loopCalls.map(call => ({ ...call, line: call.line + part.offset }))
+        }));
+        cellMetrics.loops.forEach(loop => metrics.loops.push({
+            ...loop,
+            nodeId: rename(loop.nodeId),
+            line: loop.line + part.offset
+        }));
+
+        const pseudocode = parseJson<{ pseudocode: string, lineMapping: typeof pseudocodeMapping }>(
+            analysis.pseudocode, { pseudocode: '', lineMapping: [] });
+        if (pseudocode.pseudocode) {
+            pseudocodeParts.push(pseudocode.pseudocode);
+            pseudocode.lineMapping.forEach(mapping => pseudocodeMapping.push({
+                pythonLine: mapping.pythonLine + part.offset,
+                pseudocodeLine: mapping.pseudocodeLine + pseudocodeOffset
+            }));
+            pseudocodeOffset += pseudocode.pseudocode.split('\n').length;
+        }
+    });
+
+    return {
+        mermaidCode: mermaidLines.join('\n'),
+        lineMapping: JSON.stringify(lineMapping),
+        nodeSequence: JSON.stringify(nodeSequence),
+        nodeMeta: JSON.stringify(nodeMeta),
+        scopeInfo: JSON.stringify({ scope: null, scopes: [] }),
+        metrics: JSON.stringify(metrics),
+        pseudocode: JSON.stringify({ pseudocode: pseudocodeParts.join('\n'), lineMapping: pseudocodeMapping })
+    };
+}
+
+function parseJson<T>(text: string, fallback: T): T {
+    try {
+        return JSON.parse(text) as T;
+    } catch (e) {
+        console.error('Error parsing cell analysis:', e);
+        return fallback;
+    }
+}
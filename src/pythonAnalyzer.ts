@@ -2,19 +2,70 @@ import * as path from 'path';
 import * as fs from 'fs';
 import * as os from 'os';
 import { spawn } from 'child_process';
+import { ExternalModules } from './symbolIndex';
 
 
 
+export interface FlowchartAnalysis {
+    mermaidCode: string;
+    lineMapping: string;
+    nodeSequence: string;
+    nodeMeta: string;
+    scopeInfo: string;      // 範圍模式：{ scope, scopes } JSON
+    metrics: string;        // 各函式的靜態效能指標：{ functions, loops } JSON
+    pseudocode: string;     // 本地規則產生的 pseudocode：{ pseudocode, lineMapping } JSON
+}
+
+// 串流片段：outline 為所有頂層函式節點與 classDef，main 為一段主流程，def 為一個頂層函式的子圖
+export interface FlowchartChunk {
+    kind: 'outline' | 'main' | 'def';
+    lines: string[];
+    classDefs?: string[];
+}
+
+// 與 Python 端的 STREAM_MARKER 相同
+const STREAM_MARKER = '---CHUNK---';
+
 // 使用 Python 的 AST 模組來解析程式碼
-export function parsePythonWithAST(code: string): Promise<{
-    mermaidCode: string, 
-    lineMapping: string, 
-    nodeSequence: string,
-    nodeMeta: string
-}> {
+// externalModules：工作區符號索引中被 import 模組的頂層定義，用於畫出跨模組的呼叫邊
+// scopeLine：指定時只分析包含該行（1-based）的函式或類別
+// maxLabelLength：節點標籤最大字數（0 表示不截斷），未指定時使用 Python 端的預設值
+// onChunk：指定時 Python 端邊分析邊輸出片段（主流程優先），完整結果仍由回傳的 Promise 提供
+// parallelWorkers：大型模組的頂層函式以多個行程分析（0 表示不平行）
+export function parsePythonWithAST(
+    code: string,
+    externalModules: ExternalModules = {},
+    scopeLine?: number,
+    maxLabelLength?: number,
+    onChunk?: (chunk: FlowchartChunk) => void,
+    parallelWorkers: number = 0
+): Promise<FlowchartAnalysis> {
+    const pythonScript = setPythonStdoutEncoding() + generatePythonASTClass()
+        + generatePythonMain(code, externalModules, scopeLine, maxLabelLength, onChunk !== undefined, parallelWorkers);
+    return runPythonScript(pythonScript, onChunk).then(parseAnalysisOutput);
+}
+
+// 送給 Claude 的程式骨架：每行以原始行號開頭，ranges 為多行語句的最後一行
+export interface PromptSkeleton {
+    skeleton: string;
+    ranges: Record<string, number>;
+}
+
+// 由 AST 產生提示詞用的程式骨架（省略註解、docstring 與過長的字面值）
+export function generatePromptSkeleton(code: string): Promise<PromptSkeleton> {
+    const pythonScript = setPythonStdoutEncoding() + generatePythonASTClass() + generateSkeletonMain(code);
+    return runPythonScript(pythonScript).then(output => JSON.parse(output.trim()) as PromptSkeleton);
+}
+
+// 只產生本地規則的 pseudocode（不建流程圖），回傳與 FlowchartAnalysis.pseudocode 相同格式的 JSON
+export function generateLocalPseudocode(code: string): Promise<string> {
+    const pythonScript = setPythonStdoutEncoding() + generatePythonASTClass() + generatePseudocodeMain(code);
+    return runPythonScript(pythonScript).then(output => output.trim());
+}
+
+// 執行產生的 Python 腳本並回傳 stdout；onChunk 指定時轉交其中的串流片段
+function runPythonScript(pythonScript: string, onChunk?: (chunk: FlowchartChunk) => void): Promise<string> {
     return new Promise((resolve, reject) => {
-        const pythonScript = setPythonStdoutEncoding() + generatePythonASTClass() + generatePythonMain(code);
-        
         // 創建臨時文件來避免命令行長度限制
         const tempDir = os.tmpdir();
         const tempScriptPath = path.join(tempDir, `vscode_flowchart_${Date.now()}.py`);
@@ -40,12 +91,7 @@ export function parsePythonWithAST(code: string): Promise<{
             reject(error);
         }
         
-        function cleanupAndResolve(result: {
-            mermaidCode: string, 
-            lineMapping: string, 
-            nodeSequence: string,
-            nodeMeta: string
-        }) {
+        function cleanupAndResolve(result: string) {
             try {
                 fs.unlinkSync(tempScriptPath);
             } catch (cleanupError) {
@@ -70,9 +116,29 @@ export function parsePythonWithAST(code: string): Promise<{
             
             let output = '';
             let error = '';
+            let partialLine = '';
             
-            python.stdout.on('data', (data) => {
-                output += data.toString();
+            // 以字串接收，避免多位元組字元被切在兩個 data 事件之間
+            python.stdout.setEncoding('utf8');
+            python.stdout.on('data', (data: string) => {
+                if (!onChunk) {
+                    output += data;
+                    return;
+                }
+                // 串流片段各佔一行：完整的行一到就轉交，其餘照常累積
+                const lines = (partialLine + data).split('\n');
+                partialLine = lines.pop() ?? '';
+                for (const line of lines) {
+                    if (!line.startsWith(STREAM_MARKER)) {
+                        output += line + '\n';
+                        continue;
+                    }
+                    try {
+                        onChunk(JSON.parse(line.slice(STREAM_MARKER.length)));
+                    } catch (e) {
+                        console.error('Error parsing flowchart chunk:', e);
+                    }
+                }
             });
             
             python.stderr.on('data', (data) => {
@@ -83,6 +149,7 @@ export function parsePythonWithAST(code: string): Promise<{
             });
             
             python.on('close', (exitCode) => {
+                output += partialLine;
                 if (exitCode !== 0) {
                     console.error(`${pythonCmd} script failed with exit code:`, exitCode);
                     console.error('Full error output:', error);
@@ -91,27 +158,7 @@ export function parsePythonWithAST(code: string): Promise<{
                     currentCommandIndex++;
                     tryNextPython();
                 } else {
-                    const parts = output.trim().split('---LINE_MAPPING---');
-                    const mermaidCode = parts[0].trim();
-                    const afterMapping = parts[1]?.trim() || '{}';
-
-                    const secondParts = afterMapping.split('---NODE_SEQUENCE---');
-                    const lineMapping = secondParts[0].trim();
-                    const afterSeq = secondParts[1]?.trim() || '[]';
-
-                    const thirdParts = afterSeq.split('---NODE_META---');
-                    const nodeSequence = thirdParts[0].trim();
-                    const nodeMeta = (thirdParts[1] ?? '{}').trim();
-                    
-                    console.log('Raw Python output line mapping:', lineMapping);
-                    console.log('Raw Python output node sequence:', nodeSequence);
-                    
-                    cleanupAndResolve({
-                        mermaidCode: mermaidCode,
-                        lineMapping: lineMapping,
-                        nodeSequence: nodeSequence,
-                        nodeMeta: nodeMeta
-                    });
+                    cleanupAndResolve(output);
                 }
             });
             
@@ -130,20 +177,113 @@ export function parsePythonWithAST(code: string): Promise<{
 }
 
 
+// 依分隔標記切出分析結果的各個區段
+function parseAnalysisOutput(output: string): FlowchartAnalysis {
+    const parts = output.trim().split('---LINE_MAPPING---');
+    const mermaidCode = parts[0].trim();
+    const afterMapping = parts[1]?.trim() || '{}';
+
+    const secondParts = afterMapping.split('---NODE_SEQUENCE---');
+    const lineMapping = secondParts[0].trim();
+    const afterSeq = secondParts[1]?.trim() || '[]';
+
+    const thirdParts = afterSeq.split('---NODE_META---');
+    const nodeSequence = thirdParts[0].trim();
+    const afterMeta = (thirdParts[1] ?? '{}').trim();
+
+    const fourthParts = afterMeta.split('---SCOPE---');
+    const nodeMeta = fourthParts[0].trim();
+    const afterScope = (fourthParts[1] ?? '{}').trim();
+
+    const fifthParts = afterScope.split('---METRICS---');
+    const scopeInfo = fifthParts[0].trim();
+    const afterMetrics = (fifthParts[1] ?? '{}').trim();
+
+    const sixthParts = afterMetrics.split('---PSEUDOCODE---');
+    const metrics = sixthParts[0].trim();
+    const pseudocode = (sixthParts[1] ?? '').trim();
+    
+    console.log('Raw Python output line mapping:', lineMapping);
+    console.log('Raw Python output node sequence:', nodeSequence);
+    
+    return {
+        mermaidCode: mermaidCode,
+        lineMapping: lineMapping,
+        nodeSequence: nodeSequence,
+        nodeMeta: nodeMeta,
+        scopeInfo: scopeInfo,
+        metrics: metrics,
+        pseudocode: pseudocode
+    };
+}
+
+
 
 // 生成 Python AST 解析器類別
 function generatePythonASTClass(): string {
     const imports = () => `
 import ast
+import copy
 import json
+import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
+
+DEFAULT_MAX_LABEL_LENGTH = 80  # 節點標籤預設最大字數
+STREAM_CHUNK_LINES = 200       # 串流時主程式累積到此行數就送出一段
+STREAM_MARKER = '---CHUNK---'
+SKELETON_MAX_LITERAL = 20      # 送給 Claude 的骨架中，超過此長度的字串以 '…' 代替
+SKELETON_MAX_ITEMS = 3         # 容器字面值最多保留的元素數
 `;
 
     const classDefinition = () => `
 class FlowchartGenerator(ast.NodeVisitor):
     """AST 訪問器，用於生成 Mermaid 流程圖並追蹤行號"""
     
-    def __init__(self):
+    # Mermaid 標籤需轉義的字元，以 str.translate 一次處理
+    ESCAPE_TABLE = str.maketrans({
+        '"': '&quot;',
+        "'": '&apos;',
+        '(': '&#40;',
+        ')': '&#41;',
+        '<': '&lt;',
+        '>': '&gt;',
+    })
+    
+    # 循環複雜度中各算一個分支的語法節點（match 的 case 僅 Python 3.10+）
+    DECISION_NODES = (ast.If, ast.IfExp, ast.For, ast.AsyncFor, ast.While, ast.ExceptHandler) + (
+        (ast.match_case,) if hasattr(ast, 'match_case') else ())
+    
+    # 節點種類 -> Mermaid classDef 樣式（取代每個節點各自一行 style）
+    NODE_CLASSES = {
+        'startNode':      'fill:#c8e6c9,stroke:#1b5e20,stroke-width:2px',
+        'endNode':        'fill:#ffcdd2,stroke:#b71c1c,stroke-width:2px',
+        'importNode':     'fill:#fff3e0,stroke:#e65100,stroke-width:2px',
+        'funcNode':       'fill:#e1f5fe,stroke:#01579b,stroke-width:3px',
+        'classNode':      'fill:#f3e5f5,stroke:#4a148c,stroke-width:2px',
+        'exitNode':       'fill:#ffebee,stroke:#b71c1c,stroke-width:2px',
+        'ifNode':         'fill:#e8f5e9,stroke:#2e7d32,stroke-width:2px',
+        'loopNode':       'fill:#e3f2fd,stroke:#0d47a1,stroke-width:2px',
+        'breakNode':      'fill:#ffccbc,stroke:#d84315,stroke-width:2px',
+        'continueNode':   'fill:#ffe0b2,stroke:#ef6c00,stroke-width:2px',
+        'passNode':       'fill:#f5f5f5,stroke:#9e9e9e,stroke-width:1px,stroke-dasharray:5 5',
+        'assertNode':     'fill:#ffebee,stroke:#c62828,stroke-width:2px',
+        'globalNode':     'fill:#e8f5e9,stroke:#388e3c,stroke-width:1px,stroke-dasharray:3 3',
+        'nonlocalNode':   'fill:#e3f2fd,stroke:#1976d2,stroke-width:1px,stroke-dasharray:3 3',
+        'printNode':      'fill:#f3e5f5,stroke:#6a1b9a,stroke-width:2px',
+        'inputNode':      'fill:#e8eaf6,stroke:#283593,stroke-width:2px',
+        'callNode':       'fill:#fce4ec,stroke:#880e4f,stroke-width:3px',
+        'methodNode':     'fill:#fce4ec,stroke:#880e4f,stroke-width:2px',
+        'assignNode':     'fill:#ffffff,stroke:#424242,stroke-width:2px',
+        'assignCallNode': 'fill:#ffffff,stroke:#e91e63,stroke-width:3px',
+        'tryNode':        'fill:#fff9c4,stroke:#f57c00,stroke-width:2px',
+        'invisibleNode':  'fill:transparent,stroke:transparent',
+        'externalNode':   'fill:#eceff1,stroke:#455a64,stroke-width:2px,stroke-dasharray:4 4',
+        'stubNode':       'fill:#e1f5fe,stroke:#01579b,stroke-width:2px,stroke-dasharray:4 4',
+    }
+    
+    def __init__(self, external_modules=None, source='', max_label_length=DEFAULT_MAX_LABEL_LENGTH,
+                 parallel_workers=0):
         self.node_id = 0
         self.node_meta = {}          # nodeId -> { "label": str, "escaped_label": str, "line": int|None }
         self.mermaid_lines = ['flowchart TD']
@@ -159,26 +299,48 @@ class FlowchartGenerator(ast.NodeVisitor):
         self.line_to_node = {}       # python code到flowchart區塊的對應關係
         self.node_sequence = []      # 節點執行順序
         self.break_to_loop = {}      # break_node_id -> loop_id，追蹤 break 屬於哪個迴圈
+        self.class_members = {}      # classDef 名稱 -> 使用該樣式的節點 ID 列表
+        self.external_modules = external_modules or {}  # import 寫法 -> {函式名: {file, line}}，來自工作區符號索引
+        self.import_aliases = {}     # 本地名稱 -> import 的模組（import x / import x as y）
+        self.imported_names = {}     # 本地名稱 -> (模組, 原名)（from x import y）
+        self.external_nodes = {}     # (模組, 函式名) -> 外部函式節點 ID
+        self.stub_defs = {}          # 範圍模式：尚未畫出的本檔函式 func_id -> FunctionDef，被呼叫時才畫成 stub
+        self.method_defs = {}        # 範圍模式：所在類別的方法名稱 -> func_id，以 self. / cls. 呼叫時連到該節點
+        self.scope = None            # 範圍模式：目前分析的函式/類別 {name, start, end}
+        self.scopes = []             # 範圍模式：檔案中所有函式/類別的行號範圍
+        self.source_bytes = source.encode('utf-8')  # AST 的 col_offset 以 UTF-8 位元組計算
+        self.line_starts = self.compute_line_starts(self.source_bytes)  # 每一行起點的位元組位移
+        self.segment_cache = {}      # id(AST 節點) -> 原始碼片段，同一個運算式只切一次
+        self.max_label_length = max_label_length  # 節點標籤最大字數，0 表示不截斷
+        self.sequenced = set()       # node_sequence 中已有的節點，避免每次線性搜尋
+        self.id_namespace = None     # 平行分析的工作單元編號，節點 ID 以此區隔
+        self.id_prefix = ''          # 串流預覽的主流程節點 ID 前綴，與最終結果的編號區隔
+        self.parallel_workers = parallel_workers  # 平行分析的行程數上限，0 或 1 表示不平行（預設）
+        self.chunk_stream = None     # 串流輸出：設定後每段主程式 / 每個頂層函式完成就寫出一個片段
+        self.emitted_lines = 1       # 已串流出去的 mermaid_lines 數（第 0 行 flowchart TD 由 webview 補上）
+        self.emitted_members = {}    # classDef 名稱 -> 已串流出去的節點數
         
         self.mermaid_lines.append('    Start([Start])')
-        self.mermaid_lines.append('    style Start fill:#c8e6c9,stroke:#1b5e20,stroke-width:2px')
+        self.assign_class('Start', 'startNode')
         self.node_sequence.append('Start')  # 記錄開始節點
+        self.sequenced.add('Start')
 `;
 
     const helperMethods = () => `
     def get_next_id(self):
         """生成下一個節點 ID"""
         self.node_id += 1
-        return f'node{self.node_id}'
+        return self.make_id('node', self.node_id)
     
     def escape_text(self, text):
         """轉義 Mermaid 特殊字符"""
-        return (text.replace('"', '&quot;')
-                   .replace("'", '&apos;')
-                   .replace('(', '&#40;')
-                   .replace(')', '&#41;')
-                   .replace('<', '&lt;')
-                   .replace('>', '&gt;'))
+        return text.translate(self.ESCAPE_TABLE)
+    
+    def truncate_label(self, text):
+        """過長的標籤截斷，避免長運算式撐大 Mermaid 輸出"""
+        if self.max_label_length and len(text) > self.max_label_length:
+            return text[:self.max_label_length - 1] + '…'
+        return text
     
     def add_line_mapping(self, node, node_id):
         """添加行號到節點ID的映射"""
@@ -188,9 +350,13 @@ class FlowchartGenerator(ast.NodeVisitor):
                 self.line_to_node[line] = []
             self.line_to_node[line].append(node_id)
     
-    def add_node(self, node_id, label, shape='rectangle', style=None, source_node=None):
+    def assign_class(self, node_id, node_class):
+        """記錄節點所屬的 classDef，最後統一輸出 class 列表"""
+        self.class_members.setdefault(node_class, []).append(node_id)
+    
+    def add_node(self, node_id, label, shape='rectangle', node_class=None, source_node=None):
         """添加節點到 Mermaid 圖"""
-        escaped_label = self.escape_text(label)
+        escaped_label = self.escape_text(self.truncate_label(label))
 
         # record node_meta data
         source_line = getattr(source_node, 'lineno', None)
@@ -205,7 +371,8 @@ class FlowchartGenerator(ast.NodeVisitor):
             self.add_line_mapping(source_node, node_id)
         
         # 記錄節點順序（新增）
-        if node_id not in self.node_sequence:
+        if node_id not in self.sequenced:
+            self.sequenced.add(node_id)
             self.node_sequence.append(node_id)
         
         if shape == 'rectangle':
@@ -220,14 +387,12 @@ class FlowchartGenerator(ast.NodeVisitor):
             self.mermaid_lines.append(f'    {node_id}[["{escaped_label}"]]')
         elif shape == 'invisible':
             self.mermaid_lines.append(f'    {node_id}[ ]')
-            self.mermaid_lines.append(f'    style {node_id} fill:transparent,stroke:transparent')
+            self.assign_class(node_id, 'invisibleNode')
             return
         
-        if style:
-            self.mermaid_lines.append(f'    style {node_id} {style}')
-        
-        # 添加點擊事件
-        self.mermaid_lines.append(f'    click {node_id} nodeClick')
+        # 點擊事件由 webview 中 mermaid-container 的委派監聽器統一處理
+        if node_class:
+            self.assign_class(node_id, node_class)
     
     # getter of node meta data
     def get_node_meta(self):
@@ -242,29 +407,213 @@ class FlowchartGenerator(ast.NodeVisitor):
     
     def add_dotted_edge(self, from_node, to_node, label='calls'):
         """添加虛線邊（用於函式呼叫）"""
+        if to_node in self.stub_defs:
+            self.add_stub_node(to_node)
         self.mermaid_lines.append(f'    {from_node} -.->|{label}| {to_node}')
+    
+    def add_stub_node(self, func_id):
+        """範圍模式下被呼叫、但不在目前範圍內的函式，只畫一個指向其定義行的節點"""
+        def_node = self.stub_defs.pop(func_id)
+        self.add_node(func_id, f'Function: {def_node.name}()', 'double', 'stubNode', def_node)
+    
+    def list_scopes(self, tree):
+        """列出所有函式與類別的行號範圍，供 extension 判斷游標所在的範圍"""
+        return [{'name': item.name, 'start': item.lineno, 'end': item.end_lineno}
+                for item in ast.walk(tree)
+                if isinstance(item, (ast.FunctionDef, ast.ClassDef))]
+    
+    def find_scope_node(self, tree, line):
+        """找出包含指定行的最內層函式或類別"""
+        target = None
+        for item in ast.walk(tree):
+            if isinstance(item, (ast.FunctionDef, ast.ClassDef)) and item.lineno <= line <= item.end_lineno:
+                if target is None or item.lineno > target.lineno:
+                    target = item
+        return target
+    
+    def analyze_scope(self, tree, line):
+        """範圍模式：只分析游標所在的函式或類別，其呼叫的本檔函式以 stub 節點表示"""
+        self.scopes = self.list_scopes(tree)
+        target = self.find_scope_node(tree, line)
+        if target is None:
+            return
+        self.scope = {'name': target.name, 'start': target.lineno, 'end': target.end_lineno}
+        self.collect_imports(tree)
+        
+        # 範圍圖沒有 Start / End
+        self.mermaid_lines = ['flowchart TD']
+        self.node_sequence = []
+        self.sequenced = set()
+        self.class_members = {}
+        
+        # 以名稱直接呼叫的只可能是模組層級的函式；其他類別的方法與巢狀函式不登記
+        for item in tree.body:
+            if isinstance(item, ast.FunctionDef) and item is not target:
+                func_id = f'func_{item.name}'
+                self.function_defs[item.name] = func_id
+                self.stub_defs[func_id] = item
+        
+        # 所在類別的方法只在以 self. / cls. 呼叫時連線；範圍本身是類別時方法都會畫出，不需要 stub
+        owner = target if isinstance(target, ast.ClassDef) else self.find_enclosing_class(tree, target)
+        if owner is not None:
+            for stmt in owner.body:
+                if not isinstance(stmt, ast.FunctionDef):
+                    continue
+                if owner is target or stmt is target:
+                    self.method_defs[stmt.name] = f'func_{stmt.name}'
+                else:
+                    # 與模組層級同名的函式區隔
+                    func_id = f'func_{owner.name}_{stmt.name}'
+                    self.method_defs[stmt.name] = func_id
+                    self.stub_defs[func_id] = stmt
+        
+        if isinstance(target, ast.ClassDef):
+            class_id = self.get_next_id()
+            self.add_node(class_id, f'Class: {target.name}', 'rectangle', 'classNode', target)
+            for stmt in target.body:
+                if isinstance(stmt, ast.FunctionDef):
+                    self.visit(stmt)
+                    self.add_edge(class_id, f'func_{stmt.name}')
+        else:
+            self.visit(target)
+    
+    def find_enclosing_class(self, tree, target):
+        """包含目標函式的最內層類別（方法或方法中的巢狀函式），不在類別內時回傳 None"""
+        owner = None
+        for item in ast.walk(tree):
+            if (isinstance(item, ast.ClassDef) and item is not target
+                    and item.lineno <= target.lineno and target.end_lineno <= item.end_lineno):
+                if owner is None or item.lineno > owner.lineno:
+                    owner = item
+        return owner
+    
+    def get_scope_info(self):
+        """範圍模式的結果：目前範圍與所有可選範圍"""
+        return json.dumps({'scope': self.scope, 'scopes': self.scopes})
+    
+    def collect_imports(self, tree):
+        """預先收集所有 import，讓先處理的函式本體也能解析外部呼叫"""
+        for item in ast.walk(tree):
+            if isinstance(item, ast.Import):
+                for alias in item.names:
+                    self.import_aliases[alias.asname or alias.name] = alias.name
+            elif isinstance(item, ast.ImportFrom):
+                module = '.' * item.level + (item.module or '')
+                for alias in item.names:
+                    self.imported_names[alias.asname or alias.name] = (module, alias.name)
+    
+    def get_dotted_name(self, node):
+        """取得 a.b.c 形式的名稱，其他運算式回傳 None"""
+        if isinstance(node, ast.Name):
+            return node.id
+        if isinstance(node, ast.Attribute):
+            owner = self.get_dotted_name(node.value)
+            return f'{owner}.{node.attr}' if owner else None
+        return None
+    
+    def link_external_call(self, from_node, call_node):
+        """呼叫的是工作區中其他模組的頂層函式時，加上指向外部函式節點的虛線邊
+        （範圍模式下以 self. / cls. 呼叫所在類別的方法時，連到該方法的節點）"""
+        func = call_node.func
+        if (isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name)
+                and func.value.id in ('self', 'cls') and func.attr in self.method_defs):
+            self.add_dotted_edge(from_node, self.method_defs[func.attr])
+            return
+        if isinstance(func, ast.Name):
+            if func.id in self.function_defs or func.id not in self.imported_names:
+                return
+            module, name = self.imported_names[func.id]
+        elif isinstance(func, ast.Attribute):
+            owner = self.get_dotted_name(func.value)
+            if owner in self.import_aliases:
+                module, name = self.import_aliases[owner], func.attr
+            elif owner in self.imported_names:
+                # from . import mod / from pkg import mod 匯入的子模組：key 與 extension 端的組法相同
+                package, submodule = self.imported_names[owner]
+                module = package + submodule if package.endswith('.') else f'{package}.{submodule}'
+                name = func.attr
+            else:
+                return
+        else:
+            return
+        
+        target = self.external_modules.get(module, {}).get(name)
+        if not target:
+            return
+        
+        ext_id = self.external_nodes.get((module, name))
+        if ext_id is None:
+            ext_id = self.make_id('ext_', len(self.external_nodes) + 1)
+            self.external_nodes[(module, name)] = ext_id
+            label = f'{module}{name}()' if module.endswith('.') else f'{module}.{name}()'
+            self.add_node(ext_id, label, 'double', 'externalNode')
+            # 外部節點的行號屬於另一個檔案，點擊時由 extension 依 file 跳轉
+            self.node_meta[ext_id]['file'] = target['file']
+            self.node_meta[ext_id]['line'] = target['line']
+        self.add_dotted_edge(from_node, ext_id)
 `;
 
     const visitMethods = () => `
     def visit_Module(self, node):
         """訪問模組節點"""
-        # 先處理所有函式定義
-        for item in node.body:
-            if isinstance(item, ast.FunctionDef) or isinstance(item, ast.ClassDef):
-                self.visit(item)
+        self.collect_imports(node)
+        
+        # 串流時先以另一個 generator 畫出主流程的預覽片段；最終結果一律依原本的順序產生，與不串流時完全相同
+        if self.chunk_stream is not None:
+            self.stream_main_preview(node)
+        
+        # 先畫函式定義（串流時每個函式完成就送出片段），再畫主程式
+        self.visit_module_definitions(node)
+        chunk_stream, self.chunk_stream = self.chunk_stream, None
         
         # 重置狀態，開始處理主程式
         self.current_node = 'Start'
-        
-        # 處理主程式（非函式定義的部分）
-        for item in node.body:
+        self.visit_module_main(node)
+        self.chunk_stream = chunk_stream
+    
+    def stream_main_preview(self, module):
+        """串流的前兩種片段：頂層函式節點與主流程。主流程的節點 ID 加上 main_ 前綴，
+        不會與之後送出的函式片段（最終結果的編號）衝突；函式名稱先以靜態掃描登記，呼叫邊才有目標"""
+        preview = FlowchartGenerator(self.external_modules, self.source_bytes.decode('utf-8'), self.max_label_length)
+        preview.id_prefix = 'main_'
+        preview.chunk_stream = self.chunk_stream
+        preview.collect_imports(module)
+        preview.emit_outline(module)
+        for item in module.body:
+            if isinstance(item, ast.FunctionDef):
+                for name in static_registered_defs(item):
+                    preview.function_defs[name] = f'func_{name}'
+        preview.visit_module_main(module)
+        preview.emit_chunk('main')
+        
+        # Start 節點已在預覽片段中送出
+        self.emitted_lines = len(self.mermaid_lines)
+        self.emitted_members = {node_class: len(members) for node_class, members in self.class_members.items()}
+    
+    def visit_module_definitions(self, module):
+        """處理所有函式與類別定義（大型模組的頂層函式可平行分析，合併結果與逐一走訪相同）"""
+        partials = self.analyze_definitions_parallel(module)
+        for index, item in enumerate(module.body):
+            if partials is not None and index in partials:
+                self.merge_partial(partials[index])
+            elif isinstance(item, ast.FunctionDef) or isinstance(item, ast.ClassDef):
+                self.visit(item)
+            else:
+                continue
+            self.emit_chunk('def' if isinstance(item, ast.FunctionDef) else 'main')
+    
+    def visit_module_main(self, module):
+        """處理主程式（非函式定義的部分），最後接上結束節點"""
+        for item in module.body:
             if not isinstance(item, ast.FunctionDef) and not isinstance(item, ast.ClassDef):
                 self.visit(item)
+                if len(self.mermaid_lines) - self.emitted_lines >= STREAM_CHUNK_LINES:
+                    self.emit_chunk('main')
         
         # 添加結束節點
         end_node = 'End'
         self.mermaid_lines.append('    End([End])')
-        self.mermaid_lines.append('    style End fill:#ffcdd2,stroke:#b71c1c,stroke-width:2px')
+        self.assign_class(end_node, 'endNode')
         
         # 記錄結束節點（新增）
         if end_node not in self.node_sequence:
@@ -296,7 +645,7 @@ class FlowchartGenerator(ast.NodeVisitor):
             
         node_id = self.get_next_id()
         import_names = ', '.join([alias.name if not alias.asname else f'{alias.name} as {alias.asname}' for alias in node.names])
-        self.add_node(node_id, f'import {import_names}', 'rectangle','fill:#fff3e0,stroke:#e65100,stroke-width:2px', node)
+        self.add_node(node_id, f'import {import_names}', 'rectangle', 'importNode', node)
         if self.current_node:
             self.add_edge(self.current_node, node_id)
         self.current_node = node_id
@@ -309,7 +658,7 @@ class FlowchartGenerator(ast.NodeVisitor):
         node_id = self.get_next_id()
         import_names = ', '.join([alias.name for alias in node.names])
         module = node.module or ''
-        self.add_node(node_id, f'from {module} import {import_names}', 'rectangle','fill:#fff3e0,stroke:#e65100,stroke-width:2px', node)
+        self.add_node(node_id, f'from {module} import {import_names}', 'rectangle', 'importNode', node)
         if self.current_node:
             self.add_edge(self.current_node, node_id)
         self.current_node = node_id
@@ -318,9 +667,10 @@ class FlowchartGenerator(ast.NodeVisitor):
         """處理函式定義"""
         func_id = f'func_{node.name}'
         self.function_defs[node.name] = func_id
+        self.stub_defs.pop(func_id, None)
         
         # 創建函式節點
-        self.add_node(func_id, f'Function: {node.name}()', 'double','fill:#e1f5fe,stroke:#01579b,stroke-width:3px', node)
+        self.add_node(func_id, f'Function: {node.name}()', 'double', 'funcNode', node)
         
         # 保存當前狀態
         old_current = self.current_node
@@ -361,7 +711,7 @@ class FlowchartGenerator(ast.NodeVisitor):
             return  # 不可達程式碼
             
         node_id = self.get_next_id()
-        self.add_node(node_id, f'Class: {node.name}', 'rectangle','fill:#f3e5f5,stroke:#4a148c,stroke-width:2px', node)
+        self.add_node(node_id, f'Class: {node.name}', 'rectangle', 'classNode', node)
         if self.current_node:
             self.add_edge(self.current_node, node_id)
         self.current_node = node_id
@@ -376,9 +726,9 @@ class FlowchartGenerator(ast.NodeVisitor):
         
         if node.exc:
             exc = self.get_source_segment(node.exc)
-            self.add_node(node_id, f'raise {exc}', 'rounded','fill:#ffebee,stroke:#b71c1c,stroke-width:2px', node)
+            self.add_node(node_id, f'raise {exc}', 'rounded', 'exitNode', node)
         else:
-            self.add_node(node_id, 'raise', 'rounded','fill:#ffebee,stroke:#b71c1c,stroke-width:2px', node)
+            self.add_node(node_id, 'raise', 'rounded', 'exitNode', node)
         
         if self.current_node:
             self.add_edge(self.current_node, node_id)
@@ -399,7 +749,7 @@ class FlowchartGenerator(ast.NodeVisitor):
         if_id = self.get_next_id()
         
         condition = self.get_source_segment(node.test)
-        self.add_node(if_id, f'if {condition}', 'diamond','fill:#e8f5e9,stroke:#2e7d32,stroke-width:2px', node)
+        self.add_node(if_id, f'if {condition}', 'diamond', 'ifNode', node)
         
         # 處理分支合併的情況
         if self.branch_ends and not self.current_node:
@@ -485,7 +835,7 @@ class FlowchartGenerator(ast.NodeVisitor):
         elif_id = self.get_next_id()
         
         condition = self.get_source_segment(elif_node.test)
-        self.add_node(elif_id, f'if {condition}', 'diamond','fill:#e8f5e9,stroke:#2e7d32,stroke-width:2px', elif_node)
+        self.add_node(elif_id, f'if {condition}', 'diamond', 'ifNode', elif_node)
         
         self.add_edge(parent_id, elif_id, 'No')
         
@@ -547,7 +897,7 @@ class FlowchartGenerator(ast.NodeVisitor):
     def fix_last_edge_label(self, from_node, label):
         """修正最後一條從指定節點出發的邊的標籤"""
         for i in range(len(self.mermaid_lines) - 1, -1, -1):
-            if f'{from_node} -->' in self.mermaid_lines[i] and '|' not in self.mermaid_lines[i]:
+            if self.mermaid_lines[i].startswith(f'    {from_node} --> '):
                 self.mermaid_lines[i] = self.mermaid_lines[i].replace(' --> ', f' -->|{label}| ')
                 break
     
@@ -560,7 +910,7 @@ class FlowchartGenerator(ast.NodeVisitor):
         
         target = self.get_source_segment(node.target)
         iter_expr = self.get_source_segment(node.iter)
-        self.add_node(for_id, f'for {target} in {iter_expr}', 'rectangle','fill:#e3f2fd,stroke:#0d47a1,stroke-width:2px', node)
+        self.add_node(for_id, f'for {target} in {iter_expr}', 'rectangle', 'loopNode', node)
         
         # 處理分支合併的情況
         if self.branch_ends and not self.current_node:
@@ -678,7 +1028,7 @@ class FlowchartGenerator(ast.NodeVisitor):
         while_id = self.get_next_id()
         
         condition = self.get_source_segment(node.test)
-        self.add_node(while_id, f'while {condition}', 'diamond','fill:#e3f2fd,stroke:#0d47a1,stroke-width:2px', node)
+        self.add_node(while_id, f'while {condition}', 'diamond', 'loopNode', node)
         
         # 處理分支合併連接到 while
         if self.branch_ends and not self.current_node:
@@ -801,9 +1151,9 @@ class FlowchartGenerator(ast.NodeVisitor):
         
         if node.value:
             value = self.get_source_segment(node.value)
-            self.add_node(node_id, f'return {value}', 'rounded','fill:#ffebee,stroke:#b71c1c,stroke-width:2px', node)
+            self.add_node(node_id, f'return {value}', 'rounded', 'exitNode', node)
         else:
-            self.add_node(node_id, 'return', 'rounded','fill:#ffebee,stroke:#b71c1c,stroke-width:2px', node)
+            self.add_node(node_id, 'return', 'rounded', 'exitNode', node)
         
         
         if self.branch_ends and not self.current_node:
@@ -830,6 +1180,7 @@ class FlowchartGenerator(ast.NodeVisitor):
                 func_name = node.value.func.id
                 if func_name in self.function_defs:
                     self.add_dotted_edge(node_id, self.function_defs[func_name])
+            self.link_external_call(node_id, node.value)
         
         self.current_node = None
     
@@ -839,7 +1190,7 @@ class FlowchartGenerator(ast.NodeVisitor):
             return  # 不可達程式碼
             
         node_id = self.get_next_id()
-        self.add_node(node_id, 'break', 'rounded','fill:#ffccbc,stroke:#d84315,stroke-width:2px', node)
+        self.add_node(node_id, 'break', 'rounded', 'breakNode', node)
         
         if self.current_node:
             self.add_edge(self.current_node, node_id)
@@ -861,7 +1212,7 @@ class FlowchartGenerator(ast.NodeVisitor):
             return  # 不可達程式碼
             
         node_id = self.get_next_id()
-        self.add_node(node_id, 'continue', 'rounded','fill:#ffe0b2,stroke:#ef6c00,stroke-width:2px', node)
+        self.add_node(node_id, 'continue', 'rounded', 'continueNode', node)
         
         if self.current_node:
             self.add_edge(self.current_node, node_id)
@@ -881,7 +1232,7 @@ class FlowchartGenerator(ast.NodeVisitor):
             return  # 不可達程式碼
             
         node_id = self.get_next_id()
-        self.add_node(node_id, 'pass', 'rectangle','fill:#f5f5f5,stroke:#9e9e9e,stroke-width:1px,stroke-dasharray:5,5', node)
+        self.add_node(node_id, 'pass', 'rectangle', 'passNode', node)
         
         if self.current_node:
             self.add_edge(self.current_node, node_id)
@@ -902,7 +1253,7 @@ class FlowchartGenerator(ast.NodeVisitor):
         else:
             label = f'assert {condition}'
         
-        self.add_node(node_id, label, 'diamond','fill:#ffebee,stroke:#c62828,stroke-width:2px', node)
+        self.add_node(node_id, label, 'diamond', 'assertNode', node)
         
         if self.current_node:
             self.add_edge(self.current_node, node_id)
@@ -917,7 +1268,7 @@ class FlowchartGenerator(ast.NodeVisitor):
             
         node_id = self.get_next_id()
         global_vars = ', '.join(node.names)
-        self.add_node(node_id, f'global {global_vars}', 'rectangle','fill:#e8f5e9,stroke:#388e3c,stroke-width:1px,stroke-dasharray:3,3', node)
+        self.add_node(node_id, f'global {global_vars}', 'rectangle', 'globalNode', node)
         
         if self.current_node:
             self.add_edge(self.current_node, node_id)
@@ -931,7 +1282,7 @@ class FlowchartGenerator(ast.NodeVisitor):
             
         node_id = self.get_next_id()
         nonlocal_vars = ', '.join(node.names)
-        self.add_node(node_id, f'nonlocal {nonlocal_vars}', 'rectangle','fill:#e3f2fd,stroke:#1976d2,stroke-width:1px,stroke-dasharray:3,3', node)
+        self.add_node(node_id, f'nonlocal {nonlocal_vars}', 'rectangle', 'nonlocalNode', node)
         
         if self.current_node:
             self.add_edge(self.current_node, node_id)
@@ -952,28 +1303,26 @@ class FlowchartGenerator(ast.NodeVisitor):
                 func_name = call_node.func.id
                 
                 if func_name == 'print':
-                    args = ', '.join([self.get_source_segment(arg) for arg in call_node.args])
-                    self.add_node(node_id, f'print({args})', 'parallelogram','fill:#f3e5f5,stroke:#6a1b9a,stroke-width:2px', node)
+                    self.add_node(node_id, self.get_source_segment(call_node), 'parallelogram', 'printNode', node)
                     
                     for arg in call_node.args:
                         if isinstance(arg, ast.Call) and isinstance(arg.func, ast.Name):
                             called_func = arg.func.id
                             if called_func in self.function_defs:
                                 self.add_dotted_edge(node_id, self.function_defs[called_func])
+                        if isinstance(arg, ast.Call):
+                            self.link_external_call(node_id, arg)
                 elif func_name == 'input':
-                    args = ', '.join([self.get_source_segment(arg) for arg in call_node.args])
-                    self.add_node(node_id, f'input({args})', 'parallelogram','fill:#e8eaf6,stroke:#283593,stroke-width:2px', node)
+                    self.add_node(node_id, self.get_source_segment(call_node), 'parallelogram', 'inputNode', node)
                 else:
-                    args = ', '.join([self.get_source_segment(arg) for arg in call_node.args])
-                    self.add_node(node_id, f'Call {func_name}({args})', 'rectangle','fill:#fce4ec,stroke:#880e4f,stroke-width:3px', node)
+                    self.add_node(node_id, f'Call {self.get_source_segment(call_node)}', 'rectangle', 'callNode', node)
                     
                     if func_name in self.function_defs:
                         self.add_dotted_edge(node_id, self.function_defs[func_name])
+                    self.link_external_call(node_id, call_node)
             elif isinstance(call_node.func, ast.Attribute):
-                method_name = call_node.func.attr
-                obj = self.get_source_segment(call_node.func.value)
-                args = ', '.join([self.get_source_segment(arg) for arg in call_node.args])
-                self.add_node(node_id, f'{obj}.{method_name}({args})', 'rectangle','fill:#fce4ec,stroke:#880e4f,stroke-width:2px', node)
+                self.add_node(node_id, self.get_source_segment(call_node), 'rectangle', 'methodNode', node)
+                self.link_external_call(node_id, call_node)
             
             # 處理連接
             if self.branch_ends and not self.current_node:
@@ -1005,7 +1354,13 @@ class FlowchartGenerator(ast.NodeVisitor):
         targets = ', '.join([self.get_source_segment(t) for t in node.targets])
         value = self.get_source_segment(node.value)
         
-        self.add_node(node_id, f'{targets} = {value}', 'rectangle','fill:#ffffff,stroke:#424242,stroke-width:2px', node)
+        # 呼叫本檔案中定義的函式時使用強調樣式
+        calls_local = (isinstance(node.value, ast.Call)
+                       and isinstance(node.value.func, ast.Name)
+                       and node.value.func.id in self.function_defs)
+        assign_class = 'assignCallNode' if calls_local else 'assignNode'
+        
+        self.add_node(node_id, f'{targets} = {value}', 'rectangle', assign_class, node)
         
         # 處理多個分支合併的情況
         if self.branch_ends and not self.current_node:
@@ -1029,7 +1384,7 @@ class FlowchartGenerator(ast.NodeVisitor):
                 func_name = node.value.func.id
                 if func_name in self.function_defs:
                     self.add_dotted_edge(node_id, self.function_defs[func_name])
-                    self.mermaid_lines.append(f'    style {node_id} stroke:#e91e63,stroke-width:3px')
+            self.link_external_call(node_id, node.value)
         
         self.current_node = node_id
     
@@ -1044,7 +1399,7 @@ class FlowchartGenerator(ast.NodeVisitor):
         op = self.get_op_symbol(node.op)
         value = self.get_source_segment(node.value)
         
-        self.add_node(node_id, f'{target} {op}= {value}', 'rectangle','fill:#ffffff,stroke:#424242,stroke-width:2px', node)
+        self.add_node(node_id, f'{target} {op}= {value}', 'rectangle', 'assignNode', node)
         
         # 處理分支合併
         if self.branch_ends and not self.current_node:
@@ -1071,76 +1426,45 @@ class FlowchartGenerator(ast.NodeVisitor):
             return  # 不可達程式碼
             
         try_id = self.get_next_id()
-        self.add_node(try_id, 'try-except', 'rectangle','fill:#fff9c4,stroke:#f57c00,stroke-width:2px', node)
+        self.add_node(try_id, 'try-except', 'rectangle', 'tryNode', node)
         
         if self.current_node:
             self.add_edge(self.current_node, try_id)
         
         self.current_node = try_id
     
+    @staticmethod
+    def compute_line_starts(source_bytes):
+        """計算每一行起點的位元組位移，之後以 lineno/col_offset 直接定位"""
+        starts = [0]
+        pos = source_bytes.find(b'\\n')
+        while pos != -1:
+            starts.append(pos + 1)
+            pos = source_bytes.find(b'\\n', pos + 1)
+        return starts
+    
     def get_source_segment(self, node):
-        """獲取節點的源代碼片段"""
-        if isinstance(node, ast.Name):
-            return node.id
-        elif isinstance(node, ast.Constant):
-            return repr(node.value)
-        elif isinstance(node, ast.BinOp):
-            left = self.get_source_segment(node.left)
-            right = self.get_source_segment(node.right)
-            op = self.get_op_symbol(node.op)
-            return f'{left} {op} {right}'
-        elif isinstance(node, ast.BoolOp):
-            # 處理 and/or 運算
-            op = self.get_op_symbol(node.op)
-            values = [self.get_source_segment(v) for v in node.values]
-            return f' {op} '.join(values)
-        elif isinstance(node, ast.UnaryOp):
-            # 處理 not 等一元運算
-            op = self.get_op_symbol(node.op)
-            operand = self.get_source_segment(node.operand)
-            return f'{op}{operand}'
-        elif isinstance(node, ast.Compare):
-            left = self.get_source_segment(node.left)
-            ops = [self.get_op_symbol(op) for op in node.ops]
-            comparators = [self.get_source_segment(c) for c in node.comparators]
-            result = left
-            for op, comp in zip(ops, comparators):
-                result += f' {op} {comp}'
-            return result
-        elif isinstance(node, ast.Call):
-            func = self.get_source_segment(node.func)
-            args = ', '.join([self.get_source_segment(arg) for arg in node.args])
-            return f'{func}({args})'
-        elif isinstance(node, ast.Attribute):
-            value = self.get_source_segment(node.value)
-            return f'{value}.{node.attr}'
-        elif isinstance(node, ast.Subscript):
-            value = self.get_source_segment(node.value)
-            slice_val = self.get_source_segment(node.slice)
-            return f'{value}[{slice_val}]'
-        elif isinstance(node, ast.List):
-            elements = ', '.join([self.get_source_segment(e) for e in node.elts])
-            return f'[{elements}]'
-        elif isinstance(node, ast.ListComp):
-            # 處理列表推導式
-            elt = self.get_source_segment(node.elt)
-            comp = node.generators[0]
-            target = self.get_source_segment(comp.target)
-            iter_val = self.get_source_segment(comp.iter)
-            if comp.ifs:
-                conditions = ' '.join([f'if {self.get_source_segment(c)}' for c in comp.ifs])
-                return f'[{elt} for {target} in {iter_val} {conditions}]'
-            return f'[{elt} for {target} in {iter_val}]'
-        elif isinstance(node, ast.Tuple):
-            elements = ', '.join([self.get_source_segment(e) for e in node.elts])
-            return f'({elements})'
-        elif isinstance(node, ast.Dict):
-            items = ', '.join([f'{self.get_source_segment(k)}: {self.get_source_segment(v)}' for k, v in zip(node.keys, node.values)])
-            return f'{{{items}}}'
+        """依 AST 記錄的位置從原始碼切出節點文字（結果依節點快取）"""
+        key = id(node)
+        text = self.segment_cache.get(key)
+        if text is not None:
+            return text
+        
+        if getattr(node, 'end_lineno', None) is not None and node.end_lineno <= len(self.line_starts):
+            start = self.line_starts[node.lineno - 1] + node.col_offset
+            end = self.line_starts[node.end_lineno - 1] + node.end_col_offset
+            text = self.source_bytes[start:end].decode('utf-8', errors='replace')
+            if node.end_lineno != node.lineno:
+                # 跨行的運算式合併成一行
+                text = ' '.join(part.strip() for part in text.splitlines())
+        elif hasattr(ast, 'unparse'):
+            text = ast.unparse(node)
         else:
-            return str(type(node).__name__)
+            text = type(node).__name__
+        
+        self.segment_cache[key] = text
+        return text
     
-            
     def get_op_symbol(self, op):
         """獲取運算符號"""
         op_map = {
@@ -1155,7 +1479,11 @@ class FlowchartGenerator(ast.NodeVisitor):
     
     def generate_mermaid(self):
         """生成最終的 Mermaid 程式碼"""
-        return '\\n'.join(self.mermaid_lines)
+        lines = list(self.mermaid_lines)
+        for node_class, members in self.class_members.items():
+            lines.append(f'    classDef {node_class} {self.NODE_CLASSES[node_class]}')
+            lines.append(f'    class {",".join(members)} {node_class}')
+        return '\\n'.join(lines)
     
     def get_line_mapping(self):
         """獲取行號到節點ID的映射"""
@@ -1164,82 +1492,920 @@ class FlowchartGenerator(ast.NodeVisitor):
     def get_node_sequence(self):
         """獲取節點執行順序（新增）"""
         return json.dumps(self.node_sequence)
+    
+    def emit_outline(self, node):
+        """串流的第一個片段：所有頂層函式的節點，主流程先畫時呼叫邊已有目標（與 visit_FunctionDef 畫出的節點相同）"""
+        if self.chunk_stream is None:
+            return
+        names = [item.name for item in node.body if isinstance(item, ast.FunctionDef)]
+        lines = [f'    func_{name}[["{self.escape_text(self.truncate_label(f"Function: {name}()"))}"]]' for name in names]
+        if names:
+            lines.append(f'    class {",".join(f"func_{name}" for name in names)} funcNode')
+        self.write_chunk({
+            'kind': 'outline',
+            'lines': lines,
+            'classDefs': [f'    classDef {node_class} {style}' for node_class, style in self.NODE_CLASSES.items()]
+        })
+    
+    def emit_chunk(self, kind):
+        """串流輸出上次送出後新增的 Mermaid 行；kind 為 main（主流程）或 def（頂層函式）"""
+        if self.chunk_stream is None or len(self.mermaid_lines) == self.emitted_lines:
+            return
+        lines = self.mermaid_lines[self.emitted_lines:]
+        self.emitted_lines = len(self.mermaid_lines)
+        for node_class, members in self.class_members.items():
+            done = self.emitted_members.get(node_class, 0)
+            if len(members) > done:
+                lines.append(f'    class {",".join(members[done:])} {node_class}')
+                self.emitted_members[node_class] = len(members)
+        self.write_chunk({'kind': kind, 'lines': lines})
+    
+    def write_chunk(self, chunk):
+        """片段各佔一行，extension 依 STREAM_MARKER 與其他輸出區分"""
+        print(STREAM_MARKER + json.dumps(chunk), file=self.chunk_stream, flush=True)
+    
+    def make_id(self, prefix, number):
+        """節點 ID；平行分析的工作單元加上命名空間 <單元:ID>，合併時再換成全域編號"""
+        if self.id_namespace is None:
+            return f'{self.id_prefix}{prefix}{number}'
+        return f'<{self.id_namespace}:{prefix}{number}>'
+    
+    def analyze_definitions_parallel(self, module):
+        """有設定 parallel_workers 且模組夠大時把頂層函式分批交給行程池分析，回傳 {body 索引: 部分圖}；
+        不適用或失敗時回傳 None。行程池要在每個行程重新解析原始碼（spawn 平台還會重新匯入本檔），
+        單核或核心數少時反而較慢，所以只在使用者開啟時使用；行程數照呼叫端指定（extension 已限制在核心數以內）"""
+        indices = [i for i, item in enumerate(module.body) if isinstance(item, ast.FunctionDef)]
+        workers = min(self.parallel_workers, PARALLEL_MAX_WORKERS)
+        if workers < 2 or len(indices) < 2 or len(self.line_starts) < PARALLEL_MIN_LINES:
+            return None
+        
+        # 依行數切成連續的批次，每批附上「前面的函式會登記哪些名稱」的靜態估計
+        total = sum(module.body[i].end_lineno - module.body[i].lineno + 1 for i in indices)
+        batch_lines = max(1, total // (workers * PARALLEL_BATCHES_PER_WORKER))
+        tasks = []
+        batch, size, known = [], 0, []
+        for i in indices:
+            if not batch:
+                tasks.append((batch, list(known)))
+            batch.append(i)
+            size += module.body[i].end_lineno - module.body[i].lineno + 1
+            known.extend(static_registered_defs(module.body[i]))
+            if size >= batch_lines:
+                batch, size = [], 0
+        
+        source = self.source_bytes.decode('utf-8')
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_definition_worker,
+                                     initargs=(source, self.external_modules, self.max_label_length)) as pool:
+                results = list(pool.map(analyze_definitions_in_worker, tasks))
+        except Exception as e:
+            print(f"Parallel analysis unavailable, using serial: {e}", file=sys.stderr)
+            return None
+        
+        # 靜態估計與實際登記的名稱不同時（例如不會被走訪的巢狀函式），該批在本行程以正確名稱重算
+        partials = {}
+        registered = set()
+        fallback = None
+        for (batch, speculated), batch_results in zip(tasks, results):
+            if set(speculated) != registered:
+                if fallback is None:
+                    fallback = FlowchartGenerator(self.external_modules, source, self.max_label_length)
+                    fallback.collect_imports(module)
+                batch_results = analyze_definition_batch(fallback, module, batch, registered)
+            for index, partial in zip(batch, batch_results):
+                partials[index] = partial
+                registered.update(partial['registered'])
+        return partials
+    
+    def analyze_partial(self, item, namespace):
+        """平行分析的工作單元：獨立分析一個頂層函式，產生帶命名空間 ID 的部分圖"""
+        self.id_namespace = namespace
+        self.node_id = 0
+        self.mermaid_lines = []
+        self.node_meta = {}
+        self.line_to_node = {}
+        self.node_sequence = []
+        self.sequenced = set()
+        self.class_members = {}
+        self.external_nodes = {}
+        self.visit(item)
+        return {
+            'node_count': self.node_id,
+            'lines': self.mermaid_lines,
+            'meta': self.node_meta,
+            'line_to_node': self.line_to_node,
+            'sequence': self.node_sequence,
+            'class_members': self.class_members,
+            'externals': list(self.external_nodes.items()),
+            # 走訪到的 FunctionDef 都會畫出 func_ 節點並登記到 function_defs
+            'registered': [node_id[len('func_'):] for node_id in self.node_meta if node_id.startswith('func_')]
+        }
+    
+    def merge_partial(self, partial):
+        """依原順序接上部分圖：命名空間 ID 換成全域編號，已存在的外部函式節點改用既有節點"""
+        offset = self.node_id
+        self.node_id += partial['node_count']
+        
+        ext_map = {}
+        dropped = set()
+        for key, local_id in partial['externals']:
+            if key in self.external_nodes:
+                ext_map[local_id] = self.external_nodes[key]
+                dropped.add(local_id)
+            else:
+                ext_map[local_id] = self.make_id('ext_', len(self.external_nodes) + 1)
+                self.external_nodes[key] = ext_map[local_id]
+        
+        def remap(text):
+            return PARALLEL_ID.sub(
+                lambda m: ext_map[m.group(0)] if m.group(2) == 'ext_' else self.make_id('node', offset + int(m.group(3))),
+                text)
+        
+        for line in partial['lines']:
+            if dropped and line.lstrip().split('[', 1)[0] in dropped:
+                continue
+            self.mermaid_lines.append(remap(line))
+        for node_id, meta in partial['meta'].items():
+            if node_id not in dropped:
+                self.node_meta[remap(node_id)] = meta
+        for line, node_ids in partial['line_to_node'].items():
+            self.line_to_node.setdefault(line, []).extend(remap(node_id) for node_id in node_ids)
+        for node_id in partial['sequence']:
+            global_id = remap(node_id)
+            if node_id not in dropped and global_id not in self.sequenced:
+                self.sequenced.add(global_id)
+                self.node_sequence.append(global_id)
+        for node_class, members in partial['class_members'].items():
+            for node_id in members:
+                if node_id not in dropped:
+                    self.assign_class(remap(node_id), node_class)
+        for name in partial['registered']:
+            self.function_defs[name] = f'func_{name}'
+    
+    def compute_metrics(self, tree):
+        """每個函式的靜態效能指標：循環複雜度、迴圈巢狀深度、估計多項式次數、迴圈內的呼叫"""
+        loop_nodes = set(self.class_members.get('loopNode', []))
+        functions = []
+        loops = []
+        # 方法所屬的類別，範圍模式下方法的 stub 以 func_{類別}_{方法} 命名
+        owners = {}
+        for item in ast.walk(tree):
+            if isinstance(item, ast.ClassDef):
+                for stmt in item.body:
+                    owners[stmt] = item.name
+        units = [('<module>', 'Start' if self.scope is None else None, tree)] + [
+            (item.name, self.function_node_id(item, owners), item) for item in ast.walk(tree)
+            if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef))]
+        
+        for name, node_id, unit in units:
+            stats = {'complexity': 1, 'max_loop_depth': 0, 'order': 0, 'loop_calls': {}}
+            self.collect_metrics(unit.body, [], stats, loops, loop_nodes)
+            functions.append({
+                'name': name,
+                'nodeId': node_id,
+                'line': getattr(unit, 'lineno', 1),
+                'complexity': stats['complexity'],
+                'maxLoopDepth': stats['max_loop_depth'],
+                'order': stats['order'],
+                'loopCalls': list(stats['loop_calls'].values())
+            })
+        return json.dumps({'functions': functions, 'loops': loops})
+    
+    def function_node_id(self, item, owners):
+        """函式在圖中的節點 ID；同名的函式共用一個節點，只有該節點的定義行所在的函式算畫出，其他回傳 None"""
+        candidates = [f'func_{item.name}']
+        if item in owners:
+            candidates.append(f'func_{owners[item]}_{item.name}')
+        for node_id in candidates:
+            meta = self.node_meta.get(node_id)
+            if meta and meta.get('line') == item.lineno:
+                return node_id
+        return None
+    
+    def collect_metrics(self, nodes, chain, stats, loops, loop_nodes):
+        """走訪函式本體（不進入巢狀的函式與類別），chain 為目前所在的迴圈鏈"""
+        for node in nodes:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+                continue
+            if isinstance(node, self.DECISION_NODES):
+                stats['complexity'] += 1
+            elif isinstance(node, ast.BoolOp):
+                stats['complexity'] += len(node.values) - 1
+            
+            if isinstance(node, (ast.For, ast.AsyncFor, ast.While)):
+                is_for = not isinstance(node, ast.While)
+                # for 的 iter 只求值一次；while 的條件每一輪都會求值
+                if is_for:
+                    self.collect_metrics([node.iter], chain, stats, loops, loop_nodes)
+                inner = chain + [self.loop_sizes(node.target if is_for else None,
+                                                 node.iter if is_for else node.test, chain)]
+                order = self.enter_loop(inner, stats)
+                if not is_for:
+                    self.collect_metrics([node.test], inner, stats, loops, loop_nodes)
+                
+                loop_id = next((n for n in self.line_to_node.get(node.lineno, []) if n in loop_nodes), None)
+                if loop_id and order >= 2:
+                    loops.append({'nodeId': loop_id, 'line': node.lineno, 'depth': len(inner), 'order': order})
+                
+                self.collect_metrics(node.body, inner, stats, loops, loop_nodes)
+                self.collect_metrics(node.orelse, chain, stats, loops, loop_nodes)
+                continue
+            
+            if isinstance(node, (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)):
+                # 推導式的每個 for 也是一層迴圈
+                inner = chain
+                for generator in node.generators:
+                    stats['complexity'] += 1 + len(generator.ifs)
+                    self.collect_metrics([generator.iter], inner, stats, loops, loop_nodes)
+                    inner = inner + [self.loop_sizes(generator.target, generator.iter, inner)]
+                    self.enter_loop(inner, stats)
+                    self.collect_metrics(generator.ifs, inner, stats, loops, loop_nodes)
+                elements = [node.key, node.value] if isinstance(node, ast.DictComp) else [node.elt]
+                self.collect_metrics(elements, inner, stats, loops, loop_nodes)
+                continue
+            
+            if isinstance(node, ast.Call) and chain:
+                name = self.get_dotted_name(node.func) or self.get_source_segment(node.func)
+                stats['loop_calls'].setdefault((name, node.lineno), {
+                    'call': name,
+                    'line': node.lineno,
+                    'local': name in self.function_defs
+                })
+            
+            self.collect_metrics(list(ast.iter_child_nodes(node)), chain, stats, loops, loop_nodes)
+    
+    def enter_loop(self, chain, stats):
+        """進入一層迴圈：更新最大深度與估計次數，回傳這一層的估計次數"""
+        order = self.loop_order(chain)
+        stats['max_loop_depth'] = max(stats['max_loop_depth'], len(chain))
+        stats['order'] = max(stats['order'], order)
+        return order
+    
+    def loop_sizes(self, target, size_expr, chain):
+        """迴圈大小所依賴的名稱；外層迴圈變數換成外層迴圈的大小名稱（for j in range(i) 仍依賴 n）"""
+        bound = {}
+        for loop in chain:
+            for name in loop['targets']:
+                bound[name] = loop['sizes']
+        
+        sizes = set()
+        stack = [size_expr] if size_expr is not None else []
+        while stack:
+            node = stack.pop()
+            if isinstance(node, ast.Call):
+                # range(len(arr)) / arr.items() 取引數與呼叫對象，不取函式名稱
+                stack.extend(node.args)
+                stack.extend(keyword.value for keyword in node.keywords)
+                if isinstance(node.func, ast.Attribute):
+                    stack.append(node.func.value)
+                continue
+            dotted = self.get_dotted_name(node)
+            if dotted:
+                sizes |= bound.get(dotted, {dotted})
+                continue
+            stack.extend(ast.iter_child_nodes(node))
+        
+        targets = {n.id for n in ast.walk(target) if isinstance(n, ast.Name)} if target is not None else set()
+        return {'targets': targets, 'sizes': sizes}
+    
+    @staticmethod
+    def loop_order(chain):
+        """估計多項式次數：迴圈鏈中依賴同一個大小名稱的迴圈層數（常數範圍的迴圈不計）"""
+        counts = {}
+        for loop in chain:
+            for name in loop['sizes']:
+                counts[name] = counts.get(name, 0) + 1
+        return max(counts.values(), default=0)
+`;
+
+    const pseudocodeClass = () => `
+
+class PseudocodeGenerator:
+    """依 AST 以規則產生 pseudocode（關鍵字與 codeToPseudocode 的提示詞相同），每行記錄對應的 Python 行號"""
+    
+    INDENT = '    '
+    COMPARE_OPS = {
+        ast.Eq: '=', ast.NotEq: '≠', ast.Lt: '<', ast.LtE: '≤', ast.Gt: '>', ast.GtE: '≥',
+        ast.Is: 'IS', ast.IsNot: 'IS NOT', ast.In: 'IN', ast.NotIn: 'NOT IN'
+    }
+    BINARY_OPS = {
+        ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/', ast.FloorDiv: '//',
+        ast.Mod: '%', ast.Pow: '**', ast.MatMult: '@', ast.BitOr: '|', ast.BitAnd: '&',
+        ast.BitXor: '^', ast.LShift: '<<', ast.RShift: '>>'
+    }
+    
+    def __init__(self, source, segment):
+        self.source_lines = source.split('\\n')
+        self.segment = segment       # 共用 FlowchartGenerator 的原始碼片段（含快取）
+        self.lines = []              # (縮排層級, pseudocode 文字)
+        self.line_mapping = []       # [{pythonLine, pseudocodeLine}]，與 Claude 版本的格式相同
+    
+    def generate(self, tree):
+        """產生整個檔案的 pseudocode 與行號對應（JSON）"""
+        self.emit_block(tree.body, 0)
+        return json.dumps({
+            'pseudocode': '\\n'.join(self.INDENT * depth + text for depth, text in self.lines),
+            'lineMapping': self.line_mapping
+        })
+    
+    def emit(self, depth, text, first_line, last_line=None):
+        """輸出一行 pseudocode，並把 first_line~last_line 的 Python 行對應到這一行"""
+        self.lines.append((depth, text))
+        pseudo_line = len(self.lines)
+        for line in range(first_line, (last_line or first_line) + 1):
+            self.line_mapping.append({'pythonLine': line, 'pseudocodeLine': pseudo_line})
+    
+    def emit_block(self, stmts, depth):
+        for stmt in stmts:
+            handler = getattr(self, 'emit_' + type(stmt).__name__, None)
+            if handler:
+                handler(stmt, depth)
+            else:
+                self.emit(depth, self.segment(stmt), stmt.lineno, stmt.end_lineno)
+    
+    def emit_simple(self, node, depth, text):
+        self.emit(depth, text, node.lineno, node.end_lineno)
+    
+    def header_last_line(self, node):
+        """複合語句的標頭可能跨行，找到結尾冒號所在的行"""
+        for line in range(node.lineno, node.body[0].lineno):
+            if self.source_lines[line - 1].split('#')[0].rstrip().endswith(':'):
+                return line
+        return node.lineno
+    
+    def find_keyword_line(self, start, end, keyword):
+        """else / finally 在 AST 中沒有行號，從原始碼中找出該關鍵字所在的行"""
+        for line in range(start, end + 1):
+            text = self.source_lines[line - 1].strip()
+            if text.startswith(keyword) and text[len(keyword):].lstrip().startswith(':'):
+                return line
+        return end
+    
+    def emit_else(self, prev_body, orelse, depth, keyword='ELSE'):
+        line = self.find_keyword_line(prev_body[-1].end_lineno + 1, orelse[0].lineno, keyword.lower())
+        self.emit(depth, keyword, line)
+        self.emit_block(orelse, depth + 1)
+    
+    # ---- 運算式 ----
+    
+    def expr(self, node):
+        """邏輯與比較運算改寫為 AND / OR / NOT 與 =、≠、≤、≥，其餘保留原始碼"""
+        if isinstance(node, ast.BoolOp):
+            op = ' AND ' if isinstance(node.op, ast.And) else ' OR '
+            return op.join(self.operand(value) for value in node.values)
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return 'NOT ' + self.operand(node.operand)
+        if isinstance(node, ast.Compare):
+            parts = [self.operand(node.left)]
+            for op, comparator in zip(node.ops, node.comparators):
+                parts.append(self.COMPARE_OPS.get(type(op), '?'))
+                parts.append(self.operand(comparator))
+            return ' '.join(parts)
+        return self.segment(node)
+    
+    def operand(self, node):
+        text = self.expr(node)
+        return f'({text})' if isinstance(node, ast.BoolOp) else text
+    
+    @staticmethod
+    def constant_int(node):
+        try:
+            value = ast.literal_eval(node)
+        except Exception:
+            return None
+        return value if isinstance(value, int) else None
+    
+    def range_header(self, target, call):
+        """for ... in range(...) 改寫為 FOR i FROM a TO b，無法判斷方向時回傳 None"""
+        args = call.args
+        if call.keywords or not 1 <= len(args) <= 3 or any(isinstance(a, ast.Starred) for a in args):
+            return None
+        start = self.segment(args[0]) if len(args) > 1 else '0'
+        stop = args[1] if len(args) > 1 else args[0]
+        step = self.constant_int(args[2]) if len(args) > 2 else 1
+        if not step:
+            return None
+        stop_value = self.constant_int(stop)
+        if stop_value is not None:
+            end = str(stop_value - 1 if step > 0 else stop_value + 1)
+        else:
+            end = f'{self.segment(stop)} - 1' if step > 0 else f'{self.segment(stop)} + 1'
+        suffix = f' STEP {step}' if step != 1 else ''
+        return f'FOR {self.segment(target)} FROM {start} TO {end}{suffix} DO'
+    
+    # ---- 複合語句 ----
+    
+    def emit_FunctionDef(self, node, depth):
+        args = node.args
+        params = [a.arg for a in getattr(args, 'posonlyargs', []) + args.args]
+        if args.vararg:
+            params.append('*' + args.vararg.arg)
+        params += [a.arg for a in args.kwonlyargs]
+        if args.kwarg:
+            params.append('**' + args.kwarg.arg)
+        self.emit(depth, f'FUNCTION {node.name}({", ".join(params)})', node.lineno, self.header_last_line(node))
+        self.emit_block(node.body, depth + 1)
+    
+    emit_AsyncFunctionDef = emit_FunctionDef
+    
+    def emit_ClassDef(self, node, depth):
+        bases = ', '.join(self.segment(base) for base in node.bases)
+        self.emit(depth, f'CLASS {node.name}({bases})' if bases else f'CLASS {node.name}',
+                  node.lineno, self.header_last_line(node))
+        self.emit_block(node.body, depth + 1)
+    
+    def emit_If(self, node, depth, keyword='IF'):
+        self.emit(depth, f'{keyword} {self.expr(node.test)} THEN', node.lineno, self.header_last_line(node))
+        self.emit_block(node.body, depth + 1)
+        orelse = node.orelse
+        if (len(orelse) == 1 and isinstance(orelse[0], ast.If)
+                and self.source_lines[orelse[0].lineno - 1].lstrip().startswith('elif')):
+            self.emit_If(orelse[0], depth, 'ELSE IF')
+        elif orelse:
+            self.emit_else(node.body, orelse, depth)
+    
+    def emit_While(self, node, depth):
+        self.emit(depth, f'WHILE {self.expr(node.test)} DO', node.lineno, self.header_last_line(node))
+        self.emit_block(node.body, depth + 1)
+        if node.orelse:
+            self.emit_else(node.body, node.orelse, depth)
+    
+    def emit_For(self, node, depth):
+        header = None
+        if (isinstance(node.iter, ast.Call) and isinstance(node.iter.func, ast.Name)
+                and node.iter.func.id == 'range'):
+            header = self.range_header(node.target, node.iter)
+        if header is None:
+            header = f'FOR EACH {self.segment(node.target)} IN {self.segment(node.iter)} DO'
+        self.emit(depth, header, node.lineno, self.header_last_line(node))
+        self.emit_block(node.body, depth + 1)
+        if node.orelse:
+            self.emit_else(node.body, node.orelse, depth)
+    
+    emit_AsyncFor = emit_For
+    
+    def emit_Try(self, node, depth):
+        self.emit(depth, 'TRY', node.lineno)
+        self.emit_block(node.body, depth + 1)
+        last_body = node.body
+        for handler in node.handlers:
+            text = 'EXCEPT'
+            if handler.type:
+                text += ' ' + self.segment(handler.type)
+            if handler.name:
+                text += ' AS ' + handler.name
+            self.emit(depth, text, handler.lineno, self.header_last_line(handler))
+            self.emit_block(handler.body, depth + 1)
+            last_body = handler.body
+        if node.orelse:
+            self.emit_else(last_body, node.orelse, depth)
+            last_body = node.orelse
+        if node.finalbody:
+            self.emit_else(last_body, node.finalbody, depth, 'FINALLY')
+    
+    emit_TryStar = emit_Try
+    
+    def emit_With(self, node, depth):
+        items = []
+        for item in node.items:
+            target = self.segment(item.optional_vars) if item.optional_vars else None
+            expr = item.context_expr
+            if (isinstance(expr, ast.Call) and isinstance(expr.func, ast.Name)
+                    and expr.func.id == 'open' and expr.args and target):
+                items.append(f'OPEN {self.segment(expr.args[0])} AS {target}')
+            elif target:
+                items.append(f'WITH {self.segment(expr)} AS {target}')
+            else:
+                items.append(f'WITH {self.segment(expr)}')
+        self.emit(depth, ', '.join(items), node.lineno, self.header_last_line(node))
+        self.emit_block(node.body, depth + 1)
+    
+    emit_AsyncWith = emit_With
+    
+    def emit_Match(self, node, depth):
+        self.emit(depth, f'MATCH {self.segment(node.subject)}', node.lineno)
+        for case in node.cases:
+            text = f'CASE {self.segment(case.pattern)}'
+            if case.guard:
+                text += f' IF {self.expr(case.guard)}'
+            self.emit(depth + 1, text, case.pattern.lineno)
+            self.emit_block(case.body, depth + 2)
+    
+    # ---- 簡單語句 ----
+    
+    def emit_Return(self, node, depth):
+        self.emit_simple(node, depth, f'RETURNS {self.expr(node.value)}' if node.value else 'RETURN')
+    
+    def emit_Assign(self, node, depth):
+        targets = ' = '.join(self.segment(t) for t in node.targets)
+        value = node.value
+        if isinstance(value, ast.Call) and isinstance(value.func, ast.Name):
+            if value.func.id == 'input':
+                self.emit_simple(node, depth, f'INPUT {targets}')
+                return
+            if value.func.id == 'len' and len(value.args) == 1:
+                self.emit_simple(node, depth, f'SET {targets} = LENGTH OF {self.segment(value.args[0])}')
+                return
+        self.emit_simple(node, depth, f'SET {targets} = {self.expr(value)}')
+    
+    def emit_AnnAssign(self, node, depth):
+        target = self.segment(node.target)
+        if node.value:
+            self.emit_simple(node, depth, f'SET {target} = {self.expr(node.value)}')
+        else:
+            self.emit_simple(node, depth, f'DECLARE {target}')
+    
+    def emit_AugAssign(self, node, depth):
+        target = self.segment(node.target)
+        if self.constant_int(node.value) == 1 and isinstance(node.op, (ast.Add, ast.Sub)):
+            keyword = 'INCREMENT' if isinstance(node.op, ast.Add) else 'DECREMENT'
+            self.emit_simple(node, depth, f'{keyword} {target}')
+            return
+        value = self.segment(node.value)
+        if isinstance(node.value, (ast.BinOp, ast.BoolOp, ast.Compare, ast.IfExp, ast.Lambda)):
+            value = f'({value})'
+        op = self.BINARY_OPS.get(type(node.op), '?')
+        self.emit_simple(node, depth, f'SET {target} = {target} {op} {value}')
+    
+    def emit_Expr(self, node, depth):
+        value = node.value
+        if isinstance(value, ast.Constant) and isinstance(value.value, str):
+            return  # docstring 不輸出
+        if not isinstance(value, ast.Call):
+            self.emit_simple(node, depth, self.segment(value))
+            return
+        func = value.func
+        if isinstance(func, ast.Name) and func.id == 'print':
+            self.emit_simple(node, depth, 'OUTPUT ' + ', '.join(self.expr(arg) for arg in value.args))
+        elif isinstance(func, ast.Name) and func.id == 'input':
+            self.emit_simple(node, depth, 'INPUT')
+        elif isinstance(func, ast.Attribute) and func.attr == 'append' and len(value.args) == 1:
+            self.emit_simple(node, depth, f'APPEND {self.segment(value.args[0])} TO {self.segment(func.value)}')
+        elif isinstance(func, ast.Attribute) and func.attr == 'remove' and len(value.args) == 1:
+            self.emit_simple(node, depth, f'REMOVE {self.segment(value.args[0])} FROM {self.segment(func.value)}')
+        else:
+            self.emit_simple(node, depth, 'CALL ' + self.segment(value))
+    
+    def emit_Break(self, node, depth):
+        self.emit_simple(node, depth, 'BREAK')
+    
+    def emit_Continue(self, node, depth):
+        self.emit_simple(node, depth, 'CONTINUE')
+    
+    def emit_Pass(self, node, depth):
+        self.emit_simple(node, depth, 'PASS')
+    
+    def emit_Import(self, node, depth):
+        self.emit_simple(node, depth, 'IMPORT ' + ', '.join(alias.name for alias in node.names))
+    
+    def emit_ImportFrom(self, node, depth):
+        names = ', '.join(alias.name for alias in node.names)
+        module = '.' * node.level + (node.module or '')
+        self.emit_simple(node, depth, f'IMPORT {names} FROM {module}')
+    
+    def emit_Raise(self, node, depth):
+        self.emit_simple(node, depth, f'RAISE {self.segment(node.exc)}' if node.exc else 'RAISE')
+    
+    def emit_Assert(self, node, depth):
+        self.emit_simple(node, depth, f'ASSERT {self.expr(node.test)}')
+    
+    def emit_Global(self, node, depth):
+        self.emit_simple(node, depth, 'GLOBAL ' + ', '.join(node.names))
+    
+    def emit_Nonlocal(self, node, depth):
+        self.emit_simple(node, depth, 'NONLOCAL ' + ', '.join(node.names))
+    
+    def emit_Delete(self, node, depth):
+        self.emit_simple(node, depth, 'DELETE ' + ', '.join(self.segment(t) for t in node.targets))
+`;
+
+    const skeletonClass = () => `
+
+class LiteralElider(ast.NodeTransformer):
+    """把過長的字串與容器字面值換成 '…' / ...，只保留程式結構"""
+    
+    def visit_Constant(self, node):
+        if isinstance(node.value, (str, bytes)) and len(node.value) > SKELETON_MAX_LITERAL:
+            return ast.copy_location(ast.Constant('…'), node)
+        return node
+    
+    def visit_JoinedStr(self, node):
+        if len(ast.unparse(node)) > SKELETON_MAX_LITERAL:
+            return ast.copy_location(ast.Constant('…'), node)
+        return node
+    
+    def visit_List(self, node):
+        self.generic_visit(node)
+        # 賦值目標（a, b, c = ...）不能省略
+        if not isinstance(getattr(node, 'ctx', ast.Load()), ast.Load):
+            return node
+        if len(node.elts) > SKELETON_MAX_ITEMS:
+            node.elts = node.elts[:SKELETON_MAX_ITEMS] + [ast.Constant(...)]
+        return node
+    
+    visit_Tuple = visit_List
+    visit_Set = visit_List
+    
+    def visit_Dict(self, node):
+        self.generic_visit(node)
+        if len(node.keys) > SKELETON_MAX_ITEMS:
+            node.keys = node.keys[:SKELETON_MAX_ITEMS] + [ast.Constant(...)]
+            node.values = node.values[:SKELETON_MAX_ITEMS] + [ast.Constant(...)]
+        return node
+
+
+class SkeletonGenerator(PseudocodeGenerator):
+    """Claude 提示詞用的程式骨架：每個語句一行並以原始行號開頭，省略註解、docstring 與過長的字面值"""
+    
+    def __init__(self, source):
+        super().__init__(source, ast.unparse)
+        self.ranges = {}             # 骨架行號 -> 該語句在原始碼的最後一行
+    
+    def generate(self, tree):
+        """產生骨架文字與行號範圍（JSON）"""
+        LiteralElider().visit(tree)
+        self.emit_block(tree.body, 0)
+        return json.dumps({
+            'skeleton': '\\n'.join(f'{line}| {self.INDENT * depth}{text}' for depth, text, line in self.lines),
+            'ranges': self.ranges
+        })
+    
+    def emit(self, depth, text, first_line, last_line=None):
+        self.lines.append((depth, text, first_line))
+        self.ranges[first_line] = max(self.ranges.get(first_line, first_line), last_line or first_line)
+    
+    def emit_block(self, stmts, depth):
+        for stmt in stmts:
+            if isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Constant) and isinstance(stmt.value.value, str):
+                continue  # docstring 不送出
+            handler = getattr(self, 'skeleton_' + type(stmt).__name__, None)
+            if handler:
+                handler(stmt, depth)
+            elif hasattr(stmt, 'body'):
+                self.emit_compound(stmt, depth)
+            else:
+                self.emit(depth, self.segment(stmt), stmt.lineno, stmt.end_lineno)
+    
+    def emit_else(self, prev_body, orelse, depth, keyword='ELSE'):
+        keyword = keyword.lower()
+        line = self.find_keyword_line(prev_body[-1].end_lineno + 1, orelse[0].lineno, keyword)
+        self.emit(depth, keyword + ':', line)
+        self.emit_block(orelse, depth + 1)
+    
+    def header(self, node):
+        """複合語句只留標頭（def / if / for ...:），本體另外逐行輸出"""
+        shell = copy.copy(node)
+        for field in ('body', 'orelse', 'handlers', 'finalbody', 'cases', 'decorator_list'):
+            if hasattr(shell, field):
+                setattr(shell, field, [])
+        return ast.unparse(shell).strip().split('\\n')[0]
+    
+    def emit_compound(self, node, depth):
+        for decorator in getattr(node, 'decorator_list', []):
+            self.emit(depth, '@' + ast.unparse(decorator), decorator.lineno, decorator.end_lineno)
+        self.emit(depth, self.header(node), node.lineno, self.header_last_line(node))
+        self.emit_block(node.body, depth + 1)
+    
+    def skeleton_If(self, node, depth, keyword='if'):
+        self.emit(depth, f'{keyword} {self.segment(node.test)}:', node.lineno, self.header_last_line(node))
+        self.emit_block(node.body, depth + 1)
+        orelse = node.orelse
+        if (len(orelse) == 1 and isinstance(orelse[0], ast.If)
+                and self.source_lines[orelse[0].lineno - 1].lstrip().startswith('elif')):
+            self.skeleton_If(orelse[0], depth, 'elif')
+        elif orelse:
+            self.emit_else(node.body, orelse, depth)
+    
+    def skeleton_For(self, node, depth):
+        self.emit_compound(node, depth)
+        if node.orelse:
+            self.emit_else(node.body, node.orelse, depth)
+    
+    skeleton_AsyncFor = skeleton_For
+    skeleton_While = skeleton_For
+    
+    def skeleton_Try(self, node, depth):
+        self.emit(depth, 'try:', node.lineno)
+        self.emit_block(node.body, depth + 1)
+        last_body = node.body
+        for handler in node.handlers:
+            self.emit_compound(handler, depth)
+            last_body = handler.body
+        if node.orelse:
+            self.emit_else(last_body, node.orelse, depth)
+            last_body = node.orelse
+        if node.finalbody:
+            self.emit_else(last_body, node.finalbody, depth, 'FINALLY')
+    
+    skeleton_TryStar = skeleton_Try
+    
+    def skeleton_Match(self, node, depth):
+        self.emit(depth, self.header(node), node.lineno)
+        for case in node.cases:
+            self.emit(depth + 1, self.header(case), case.pattern.lineno)
+            self.emit_block(case.body, depth + 2)
+`;
+
+    const parallelAnalysis = () => `
+
+# ---- 平行分析：大型模組的頂層函式分給行程池，各自產生部分圖後依原順序合併 ----
+
+PARALLEL_MIN_LINES = 3000          # 開啟平行分析時，模組行數達到此值才使用行程池
+PARALLEL_MAX_WORKERS = 8
+PARALLEL_BATCHES_PER_WORKER = 4    # 每個行程分到的批次數，讓大小不一的函式較平均地分配
+PARALLEL_ID = re.compile(r'<(\\d+):(node|ext_)(\\d+)>')
+
+_worker_state = {}
+
+def static_registered_defs(item):
+    """靜態估計走訪頂層函式時會登記的函式名稱（visit_ClassDef 不走訪方法，所以不進入類別）"""
+    names = []
+    stack = [item]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, ast.FunctionDef):
+            names.append(node.name)
+        if not isinstance(node, ast.ClassDef):
+            stack.extend(ast.iter_child_nodes(node))
+    return names
+
+def analyze_definition_batch(generator, tree, indices, known_defs):
+    """依序分析一批頂層函式；known_defs 為前面的函式已登記的名稱"""
+    generator.function_defs = {name: f'func_{name}' for name in known_defs}
+    return [generator.analyze_partial(tree.body[i], i) for i in indices]
+
+def init_definition_worker(source, external_modules, max_label_length):
+    """工作行程初始化：每個行程只解析一次原始碼"""
+    tree = ast.parse(source)
+    generator = FlowchartGenerator(external_modules, source, max_label_length)
+    generator.collect_imports(tree)
+    _worker_state['tree'] = tree
+    _worker_state['generator'] = generator
+
+def analyze_definitions_in_worker(task):
+    indices, known_defs = task
+    return analyze_definition_batch(_worker_state['generator'], _worker_state['tree'], indices, known_defs)
 `;
 
     return [
         imports(),
         classDefinition(),
         helperMethods(),
-        visitMethods()
+        visitMethods(),
+        pseudocodeClass(),
+        skeletonClass(),
+        parallelAnalysis()
     ].join('');
 }
 
 /**
  * 生成 Python 主程式
  */
-function generatePythonMain(code: string): string {
-    const escapedCode = code
-        .replace(/\\/g, '\\\\')
-        .replace(/'''/g, "\\'''")
-        .replace(/"""/g, '\\"""');
+function generatePythonMain(
+    code: string,
+    externalModules: ExternalModules,
+    scopeLine?: number,
+    maxLabelLength?: number,
+    streamChunks: boolean = false,
+    parallelWorkers: number = 0
+): string {
+    const escapedCode = escapeTripleQuoted(code);
+    const escapedModules = escapeTripleQuoted(JSON.stringify(externalModules));
     
     return `
-# 主程式
-try:
-    code = '''${escapedCode}'''
+# 主程式（平行分析的工作行程會重新匯入本檔，只在主行程執行）
+if __name__ == '__main__':
+    try:
+        code = '''${escapedCode}'''
     
-    # 顯示每一行的內容和行號（測試用）
-    import sys
-    lines = code.split('\\n')
-    for i, line in enumerate(lines, 1):
-        print(f"Line {i}: {repr(line)}", file=sys.stderr)
+        # 顯示每一行的內容和行號（測試用）
+        import sys
+        lines = code.split('\\n')
+        for i, line in enumerate(lines, 1):
+            print(f"Line {i}: {repr(line)}", file=sys.stderr)
     
-    # 解析 AST
-    tree = ast.parse(code)
+        # 解析 AST
+        tree = ast.parse(code)
     
-    # 生成流程圖
-    generator = FlowchartGenerator()
-    generator.visit(tree)
+        # 工作區符號索引提供的外部模組定義
+        external_modules = json.loads('''${escapedModules}''')
     
-    # 輸出 Mermaid 程式碼
-    print(generator.generate_mermaid())
-    print("---LINE_MAPPING---")
+        # 生成流程圖（指定 scope_line 時只分析游標所在的函式或類別）
+        scope_line = ${scopeLine ?? 'None'}
+        # 節點標籤直接由原始碼位置切出，需要原始碼本身
+        max_label_length = ${maxLabelLength ?? 'DEFAULT_MAX_LABEL_LENGTH'}
+        generator = FlowchartGenerator(external_modules, code, max_label_length, ${Math.max(0, Math.floor(parallelWorkers))})
+        # 串流：主流程與各頂層函式完成時先送出片段，讓 webview 逐步顯示
+        if ${streamChunks ? 'True' : 'False'}:
+            generator.chunk_stream = sys.stdout
+        if scope_line is None:
+            generator.visit(tree)
+        else:
+            generator.analyze_scope(tree, scope_line)
     
-    # 輸出行號映射
-    line_mapping = generator.get_line_mapping()
-    print(line_mapping)
+        # 輸出 Mermaid 程式碼
+        print(generator.generate_mermaid())
+        print("---LINE_MAPPING---")
     
-    print("---NODE_SEQUENCE---")
+        # 輸出行號映射
+        line_mapping = generator.get_line_mapping()
+        print(line_mapping)
     
-    # 輸出節點順序（新增）
-    node_sequence = generator.get_node_sequence()
-    print(node_sequence)
+        print("---NODE_SEQUENCE---")
+    
+        # 輸出節點順序（新增）
+        node_sequence = generator.get_node_sequence()
+        print(node_sequence)
+
+        # output the node meta data
+        print("---NODE_META---")
+        print(generator.get_node_meta())
+
+        print("---SCOPE---")
+        print(generator.get_scope_info())
 
-    # output the node meta data
-    print("---NODE_META---")
-    print(generator.get_node_meta())
+        # 每個函式的靜態效能指標（節點徽章與摘要表）
+        print("---METRICS---")
+        print(generator.compute_metrics(tree))
     
-    # 錯誤測試
-    print(f"Line mapping details: {generator.line_to_node}", file=sys.stderr)
-    print(f"Node sequence: {generator.node_sequence}", file=sys.stderr)
+        # 本地規則產生的整個檔案 pseudocode，不需 Claude API 即可先顯示
+        print("---PSEUDOCODE---")
+        print(PseudocodeGenerator(code, generator.get_source_segment).generate(tree))
     
-    # 檢查並顯示 AST 節點的實際行號
-    for node in ast.walk(tree):
-        if hasattr(node, 'lineno'):
-            node_type = type(node).__name__
-            print(f"AST Node {node_type} at line {node.lineno}", file=sys.stderr)
-    
-except SyntaxError as e:
-    print(f"Syntax Error: {e}", file=sys.stderr)
-    sys.exit(1)
-except Exception as e:
-    print(f"Error: {e}", file=sys.stderr)
-    import traceback
-    traceback.print_exc(file=sys.stderr)
-    sys.exit(1)
+        # 錯誤測試
+        print(f"Line mapping details: {generator.line_to_node}", file=sys.stderr)
+        print(f"Node sequence: {generator.node_sequence}", file=sys.stderr)
+    
+        # 檢查並顯示 AST 節點的實際行號
+        for node in ast.walk(tree):
+            if hasattr(node, 'lineno'):
+                node_type = type(node).__name__
+                print(f"AST Node {node_type} at line {node.lineno}", file=sys.stderr)
+    
+    except SyntaxError as e:
+        print(f"Syntax Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        import traceback
+        traceback.print_exc(file=sys.stderr)
+        sys.exit(1)
 `;
 }
 
+// 產生提示詞骨架的主程式：輸出 {skeleton, ranges} JSON
+function generateSkeletonMain(code: string): string {
+    const escapedCode = escapeTripleQuoted(code);
+
+    return `
+# 主程式
+if __name__ == '__main__':
+    try:
+        code = '''${escapedCode}'''
+        tree = ast.parse(code)
+        print(SkeletonGenerator(code).generate(tree))
+    except SyntaxError as e:
+        print(f"Syntax Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        import traceback
+        traceback.print_exc(file=sys.stderr)
+        sys.exit(1)
+`;
+}
+
+// 只產生 pseudocode 的主程式：節點標籤的原始碼切片仍由 FlowchartGenerator 提供，但不走訪 AST
+function generatePseudocodeMain(code: string): string {
+    const escapedCode = escapeTripleQuoted(code);
+
+    return `
+# 主程式
+if __name__ == '__main__':
+    try:
+        code = '''${escapedCode}'''
+        tree = ast.parse(code)
+        generator = FlowchartGenerator({}, code)
+        print(PseudocodeGenerator(code, generator.get_source_segment).generate(tree))
+    except SyntaxError as e:
+        print(f"Syntax Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        import traceback
+        traceback.print_exc(file=sys.stderr)
+        sys.exit(1)
+`;
+}
+
+// 放進 Python '''...''' 字串前的跳脫
+function escapeTripleQuoted(text: string): string {
+    return text
+        .replace(/\\/g, '\\\\')
+        .replace(/'''/g, "\\'''")
+        .replace(/"""/g, '\\"""');
+}
+
 // That guarantees everything your script print()s comes out as UTF-8, regardless of the Windows console code page.
 function setPythonStdoutEncoding(): String{
     let retStr : String;
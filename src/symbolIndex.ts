@@ -0,0 +1,268 @@
+import * as vscode from 'vscode';
+
+/**
+ * 外部函式定義的位置
+ */
+export interface SymbolLocation {
+    file: string;
+    line: number;
+}
+
+/**
+ * import 寫法（如 'pkg.mod'、'.utils'）-> 該模組的頂層定義
+ */
+export type ExternalModules = Record<string, Record<string, SymbolLocation>>;
+
+/**
+ * 單一檔案的索引結果，連同 mtime 一起保存，重新啟動時只需重掃有變動的檔案
+ */
+interface IndexedFile {
+    mtime: number;
+    module: string;
+    defs: Array<{ name: string, line: number }>;
+}
+
+const INDEX_STATE_KEY = 'symbolIndex.v1';
+const PYTHON_GLOB = '**/*.py';
+const EXCLUDE_GLOB = '**/{node_modules,.git,.venv,venv,env,__pycache__,site-packages,.tox,.nox}/**';
+const MAX_INDEXED_FILES = 5000;
+const SCAN_BATCH_SIZE = 64;
+const SAVE_DELAY_MS = 1000;
+
+// 只看第 0 欄的 def / async def / class，也就是模組的頂層定義
+const TOP_LEVEL_DEF = /^(?:async\s+def|def|class)\s+([A-Za-z_]\w*)/;
+const FROM_IMPORT = /^\s*from\s+(\.*[\w.]*)\s+import\b(.*)$/;
+const PLAIN_IMPORT = /^\s*import\s+(.+)$/;
+
+/**
+ * 工作區 Python 符號索引：模組名稱 -> 頂層定義（檔案與行號）
+ *
+ * 索引保存在 workspaceState，啟動時只重新讀取 mtime 改變的檔案；
+ * 之後由 FileSystemWatcher 逐檔增量更新，產生流程圖時不需要再解析被 import 的檔案。
+ */
+export class WorkspaceSymbolIndex implements vscode.Disposable {
+
+    private files = new Map<string, IndexedFile>();
+    private modules = new Map<string, Map<string, SymbolLocation>>();
+    private watcher: vscode.FileSystemWatcher | undefined;
+    private saveTimeout: NodeJS.Timeout | undefined;
+
+    constructor(private readonly context: vscode.ExtensionContext) {}
+
+    /**
+     * 載入保存的索引，並補上啟動期間有變動的檔案
+     */
+    public async initialize(): Promise<void> {
+        // 先開始監看，掃描期間的編輯才不會遺失（事件直接更新該檔，掃描讀到的 mtime 也已是最新）
+        this.watcher = vscode.workspace.createFileSystemWatcher(PYTHON_GLOB);
+        this.watcher.onDidCreate(uri => this.updateFile(uri));
+        this.watcher.onDidChange(uri => this.updateFile(uri));
+        this.watcher.onDidDelete(uri => this.removeFile(uri));
+
+        const stored = this.context.workspaceState.get<Record<string, IndexedFile>>(INDEX_STATE_KEY, {});
+        const uris = await vscode.workspace.findFiles(PYTHON_GLOB, EXCLUDE_GLOB, MAX_INDEXED_FILES);
+        const start = Date.now();
+        let reindexed = 0;
+
+        // 每批的 stat / 讀檔同時進行
+        for (let i = 0; i < uris.length; i += SCAN_BATCH_SIZE) {
+            await Promise.all(uris.slice(i, i + SCAN_BATCH_SIZE).map(async uri => {
+                const key = uri.toString();
+                const previous = stored[key];
+                try {
+                    const stat = await vscode.workspace.fs.stat(uri);
+                    if (previous && previous.mtime === stat.mtime) {
+                        this.files.set(key, previous);
+                    } else {
+                        await this.indexFile(uri, stat.mtime);
+                        reindexed++;
+                    }
+                } catch (error) {
+                    console.error('Failed to index Python file:', key, error);
+                }
+            }));
+        }
+        this.rebuildModules();
+        this.scheduleSave();
+
+        console.log(`Symbol index ready: ${this.files.size} files, ${reindexed} re-indexed in ${Date.now() - start} ms`);
+    }
+
+    /**
+     * 找出程式碼 import 的模組在索引中的頂層定義，
+     * 回傳的 key 與 Python 端看到的 import 寫法相同（相對 import 保留前導的點）
+     */
+    public resolveImports(code: string, documentUri: vscode.Uri): ExternalModules {
+        const result: ExternalModules = {};
+        const importerModule = this.moduleNameFor(documentUri);
+        const importerIsPackage = /(^|[\\/])__init__\.py$/.test(documentUri.path);
+
+        for (const spec of this.collectImportSpecs(code)) {
+            const defs = this.lookupModule(spec, importerModule, importerIsPackage);
+            if (defs) {
+                result[spec] = Object.fromEntries(defs);
+            }
+        }
+        return result;
+    }
+
+    public dispose(): void {
+        this.watcher?.dispose();
+        if (this.saveTimeout) {
+            clearTimeout(this.saveTimeout);
+            this.saveTimeout = undefined;
+            this.save();
+        }
+    }
+
+    private async updateFile(uri: vscode.Uri): Promise<void> {
+        try {
+            const stat = await vscode.workspace.fs.stat(uri);
+            await this.indexFile(uri, stat.mtime);
+            this.updateModule(uri.toString());
+            this.scheduleSave();
+        } catch (error) {
+            console.error('Failed to update symbol index for', uri.toString(), error);
+        }
+    }
+
+    private removeFile(uri: vscode.Uri): void {
+        const key = uri.toString();
+        const file = this.files.get(key);
+        if (file) {
+            this.files.delete(key);
+            this.modules.delete(file.module);
+            this.scheduleSave();
+        }
+    }
+
+    private async indexFile(uri: vscode.Uri, mtime: number): Promise<void> {
+        const bytes = await vscode.workspace.fs.readFile(uri);
+        const lines = new TextDecoder('utf-8').decode(bytes).split('\n');
+        const defs: IndexedFile['defs'] = [];
+
+        lines.forEach((line, index) => {
+            const match = TOP_LEVEL_DEF.exec(line);
+            if (match) {
+                defs.push({ name: match[1], line: index + 1 });
+            }
+        });
+
+        this.files.set(uri.toString(), { mtime, module: this.moduleNameFor(uri), defs });
+    }
+
+    private rebuildModules(): void {
+        this.modules.clear();
+        for (const key of this.files.keys()) {
+            this.updateModule(key);
+        }
+    }
+
+    private updateModule(key: string): void {
+        const file = this.files.get(key);
+        if (!file) {
+            return;
+        }
+        const fsPath = vscode.Uri.parse(key).fsPath;
+        const defs = new Map<string, SymbolLocation>();
+        for (const def of file.defs) {
+            defs.set(def.name, { file: fsPath, line: def.line });
+        }
+        this.modules.set(file.module, defs);
+    }
+
+    /**
+     * 依工作區相對路徑推算模組名稱：pkg/sub/mod.py -> pkg.sub.mod，pkg/__init__.py -> pkg
+     * （筆記本 pkg/nb.ipynb 視為 pkg.nb，其 cell 的 import 依此解析）
+     */
+    private moduleNameFor(uri: vscode.Uri): string {
+        const relative = vscode.workspace.asRelativePath(uri, false).replace(/\\/g, '/');
+        const parts = relative.replace(/\.(py|ipynb)$/, '').split('/');
+        if (parts[parts.length - 1] === '__init__') {
+            parts.pop();
+        }
+        return parts.join('.');
+    }
+
+    private collectImportSpecs(code: string): Set<string> {
+        const specs = new Set<string>();
+        for (const line of code.split('\n')) {
+            const fromMatch = FROM_IMPORT.exec(line);
+            if (fromMatch) {
+                specs.add(fromMatch[1]);
+                // from . import mod / from pkg import mod：匯入的名稱也可能是子模組（之後以 mod.f() 呼叫）
+                for (const part of fromMatch[2].split('#')[0].replace(/[()\\]/g, '').split(',')) {
+                    const name = part.trim().split(/\s+as\s+/)[0].trim();
+                    if (/^[A-Za-z_]\w*$/.test(name)) {
+                        specs.add(submoduleSpec(fromMatch[1], name));
+                    }
+                }
+                continue;
+            }
+            const importMatch = PLAIN_IMPORT.exec(line);
+            if (importMatch) {
+                for (const part of importMatch[1].split('#')[0].split(',')) {
+                    const name = part.trim().split(/\s+as\s+/)[0].trim();
+                    if (name) {
+                        specs.add(name);
+                    }
+                }
+            }
+        }
+        return specs;
+    }
+
+    private lookupModule(spec: string, importerModule: string, importerIsPackage: boolean): Map<string, SymbolLocation> | undefined {
+        for (const candidate of moduleCandidates(spec, importerModule, importerIsPackage)) {
+            const defs = this.modules.get(candidate);
+            if (defs) {
+                return defs;
+            }
+        }
+        return undefined;
+    }
+
+    private scheduleSave(): void {
+        if (this.saveTimeout) {
+            clearTimeout(this.saveTimeout);
+        }
+        this.saveTimeout = setTimeout(() => {
+            this.saveTimeout = undefined;
+            this.save();
+        }, SAVE_DELAY_MS);
+    }
+
+    private save(): void {
+        this.context.workspaceState.update(INDEX_STATE_KEY, Object.fromEntries(this.files));
+    }
+}
+
+/**
+ * from 後的模組加上匯入的名稱：'.' + 'mod' -> '.mod'，'pkg' + 'mod' -> 'pkg.mod'（與 Python 端的組法相同）
+ */
+export function submoduleSpec(module: string, name: string): string {
+    return module.endsWith('.') ? module + name : `${module}.${name}`;
+}
+
+/**
+ * import 寫法可能對應的模組名稱，依優先順序排列
+ *
+ * 相對 import 以匯入者所在的套件為基準（pkg/__init__.py 本身就是 pkg 套件）；
+ * 絕對 import 先找完整模組名稱，再試同目錄下的模組（直接執行的腳本常以檔名互相 import）
+ */
+export function moduleCandidates(spec: string, importerModule: string, importerIsPackage: boolean): string[] {
+    const importerParts = importerModule ? importerModule.split('.') : [];
+    const importerPackage = importerIsPackage ? importerParts : importerParts.slice(0, -1);
+
+    const level = spec.length - spec.replace(/^\.+/, '').length;
+    if (level > 0) {
+        if (level - 1 > importerPackage.length) {
+            return [];
+        }
+        const base = importerPackage.slice(0, importerPackage.length - (level - 1));
+        const rest = spec.slice(level);
+        return [[...base, ...(rest ? [rest] : [])].join('.')];
+    }
+
+    return importerPackage.length > 0 ? [spec, [...importerPackage, spec].join('.')] : [spec];
+}
@@ -0,0 +1,24 @@
+import * as assert from 'assert';
+import { parseNumberedPseudocode } from '../claudeApi';
+
+suite('Claude API Test Suite', () => {
+	test('Numbered pseudocode lines map back to source lines', () => {
+		const text = ['PROGRAM', '3| FUNCTION total(items)', '5|     SET result = sum(items)', '8|     RETURN result'].join('\n');
+		const result = parseNumberedPseudocode(text, { '3': 3, '5': 7, '8': 8 });
+
+		assert.ok(result);
+		assert.strictEqual(result.pseudocode, ['PROGRAM', 'FUNCTION total(items)', '    SET result = sum(items)', '    RETURN result'].join('\n'));
+		// 多行語句（第 5 到 7 行）都對應到同一行 pseudocode
+		assert.deepStrictEqual(result.lineMapping, [
+			{ pythonLine: 3, pseudocodeLine: 2 },
+			{ pythonLine: 5, pseudocodeLine: 3 },
+			{ pythonLine: 6, pseudocodeLine: 3 },
+			{ pythonLine: 7, pseudocodeLine: 3 },
+			{ pythonLine: 8, pseudocodeLine: 4 }
+		]);
+	});
+
+	test('Unnumbered responses fall back to line matching', () => {
+		assert.strictEqual(parseNumberedPseudocode('FUNCTION total(items)\n    RETURN result', {}), undefined);
+	});
+});
@@ -3,7 +3,6 @@ import * as assert from 'assert';
 // You can import and use all API from the 'vscode' module
 // as well as import your extension to test it
 import * as vscode from 'vscode';
-// import * as myExtension from '../../extension';
 
 suite('Extension Test Suite', () => {
 	vscode.window.showInformationMessage('Start all tests.');
@@ -12,4 +11,16 @@ suite('Extension Test Suite', () => {
 		assert.strictEqual(-1, [1, 2, 3].indexOf(5));
 		assert.strictEqual(-1, [1, 2, 3].indexOf(0));
 	});
+
+	// 以「啟動時沒有載入延後的部分」檢查冷啟動，不量測實際時間（受機器負載影響）
+	test('Activation defers Claude API, .env and the symbol index scan', async () => {
+		const extension = vscode.extensions.all.find(e => e.packageJSON.name === 'code2pseudocode-flowchart');
+		assert.ok(extension);
+		const api = await extension.activate();
+		assert.deepStrictEqual(api.deferredState(), {
+			claudeApiLoaded: false,
+			envLoaded: false,
+			symbolIndexStarted: false
+		});
+	});
 });
@@ -0,0 +1,93 @@
+import * as assert from 'assert';
+import { FlowchartAnalysis } from '../pythonAnalyzer';
+import { joinCellAnalyses } from '../notebookFlowchart';
+
+// 一個 cell 的分析結果：x = 值，接著呼叫本 cell 的函式 f
+function cellAnalysis(value: number): FlowchartAnalysis {
+	return {
+		mermaidCode: [
+			'flowchart TD',
+			'    Start([Start])',
+			'    func_f[["Function: f&#40;&#41;"]]',
+			'    node1["return 1"]',
+			'    func_f --> node1',
+			`    node2["x = ${value}"]`,
+			'    Start --> node2',
+			'    node2 -.->|calls| func_f',
+			'    End([End])',
+			'    node2 -->|End| End',
+			'    classDef startNode fill:#c8e6c9',
+			'    class Start,End startNode',
+			'    classDef assignNode fill:#ffffff',
+			'    class node2 assignNode'
+		].join('\n'),
+		lineMapping: JSON.stringify({ '1': ['func_f'], '2': ['node1'], '3': ['node2'] }),
+		nodeSequence: JSON.stringify(['Start', 'func_f', 'node1', 'node2', 'End']),
+		nodeMeta: JSON.stringify({
+			func_f: { label: 'Function: f()', line: 1 },
+			node2: { label: `x = ${value}`, line: 3 },
+			ext_1: { label: 'helpers.run()', line: 7, file: '/ws/helpers.py' }
+		}),
+		scopeInfo: JSON.stringify({ scope: null, scopes: [] }),
+		metrics: JSON.stringify({
+			functions: [
+				{ name: '<module>', nodeId: null, line: 1, loopCalls: [] },
+				{ name: 'f', nodeId: 'func_f', line: 1, loopCalls: [{ line: 2 }] }
+			],
+			loops: [{ nodeId: 'node1', line: 2 }]
+		}),
+		pseudocode: JSON.stringify({
+			pseudocode: 'FUNCTION f\nSET x',
+			lineMapping: [{ pythonLine: 1, pseudocodeLine: 1 }, { pythonLine: 3, pseudocodeLine: 2 }]
+		})
+	};
+}
+
+suite('Notebook Flowchart Test Suite', () => {
+	const joined = joinCellAnalyses([
+		{ label: 'Cell 1', offset: 0, analysis: cellAnalysis(1) },
+		{ label: 'Cell 2', offset: 3, analysis: null },
+		{ label: 'Cell 3', offset: 5, analysis: cellAnalysis(3) }
+	]);
+	const lines = joined.mermaidCode.split('\n').map(line => line.trim());
+
+	test('Node ids get cell prefixes and cells are chained', () => {
+		assert.ok(lines.includes('cell1_Start(["Cell 1"])'));
+		assert.ok(lines.includes('cell1_node2 -.->|calls| cell1_func_f'));
+		assert.ok(lines.includes('cell1_node2 -->|End| cell2_Start'), 'End of a cell links to the next header, edge label kept');
+		assert.ok(lines.includes('cell2_Start(["Cell 2 (syntax error)"])'));
+		assert.ok(lines.includes('cell2_Start --> cell3_Start'));
+		assert.ok(lines.includes('cell3_node2 -->|End| End'));
+		assert.strictEqual(lines.filter(line => line === 'End([End])').length, 1);
+		assert.ok(lines.includes('class cell1_Start startNode'));
+		assert.ok(lines.includes('class cell3_Start,End startNode'));
+		assert.strictEqual(lines.filter(line => line.startsWith('classDef startNode')).length, 1);
+	});
+
+	test('Line numbers are shifted by the cell offset', () => {
+		assert.deepStrictEqual(JSON.parse(joined.lineMapping), {
+			'1': ['cell1_func_f'], '2': ['cell1_node1'], '3': ['cell1_node2'],
+			'6': ['cell3_func_f'], '7': ['cell3_node1'], '8': ['cell3_node2']
+		});
+		assert.deepStrictEqual(JSON.parse(joined.nodeSequence), [
+			'cell1_Start', 'cell1_func_f', 'cell1_node1', 'cell1_node2',
+			'cell2_Start',
+			'cell3_Start', 'cell3_func_f', 'cell3_node1', 'cell3_node2', 'End'
+		]);
+
+		const meta = JSON.parse(joined.nodeMeta);
+		assert.strictEqual(meta.cell3_node2.line, 8);
+		assert.deepStrictEqual(meta.cell3_ext_1, { label: 'helpers.run()', line: 7, file: '/ws/helpers.py' });
+
+		const metrics = JSON.parse(joined.metrics);
+		assert.deepStrictEqual(metrics.functions.map((fn: any) => [fn.name, fn.nodeId, fn.line]), [
+			['Cell 1', null, 1], ['f', 'cell1_func_f', 1], ['Cell 3', null, 6], ['f', 'cell3_func_f', 6]
+		]);
+		assert.strictEqual(metrics.functions[3].loopCalls[0].line, 7);
+		assert.deepStrictEqual(metrics.loops[1], { nodeId: 'cell3_node1', line: 7 });
+
+		const pseudocode = JSON.parse(joined.pseudocode);
+		assert.strictEqual(pseudocode.pseudocode, 'FUNCTION f\nSET x\nFUNCTION f\nSET x');
+		assert.deepStrictEqual(pseudocode.lineMapping[3], { pythonLine: 8, pseudocodeLine: 4 });
+	});
+});
@@ -0,0 +1,147 @@
+import * as assert from 'assert';
+import { parsePythonWithAST, generatePromptSkeleton, generateLocalPseudocode, FlowchartChunk } from '../pythonAnalyzer';
+
+// 產生超過 PARALLEL_MIN_LINES 的模組：頂層函式互相呼叫、呼叫外部模組，並有巢狀函式與類別，
+// 讓部分圖的合併（ID 重新編號、外部節點共用、已登記名稱的估計）都會用到
+function largeModule(functionCount: number, bodyLines: number): string {
+	const lines = ['import helpers', ''];
+	for (let i = 0; i < functionCount; i++) {
+		lines.push(`def func${i}(x):`);
+		if (i % 5 === 0) {
+			lines.push(`    def inner${i}(y):`, `        return y + ${i}`);
+		}
+		for (let j = 0; j < bodyLines; j++) {
+			lines.push(j % 3 === 0 ? `    if x > ${j}:` : `        x = x + ${j}`);
+		}
+		lines.push(i > 0 ? `    helpers.run(func${i - 1}(x))` : '    helpers.run(x)');
+		lines.push('    return x', '');
+		if (i % 7 === 0) {
+			lines.push(`class Holder${i}:`, '    def method(self):', `        return func${i}(1)`, '');
+		}
+	}
+	lines.push('print(func0(1))');
+	return lines.join('\n');
+}
+
+suite('Python Analyzer Test Suite', () => {
+	const smallModule = ['def f(x):', '    return x + 1', '', 'y = f(2)', 'print(y)'].join('\n');
+
+	test('Non-streaming analysis keeps definitions before the main flow', async () => {
+		const analysis = await parsePythonWithAST(smallModule);
+		assert.deepStrictEqual(JSON.parse(analysis.nodeSequence), ['Start', 'func_f', 'node1', 'node2', 'node3', 'End']);
+	});
+
+	test('Streaming sends the main flow first and returns the same final result', async () => {
+		const chunks: FlowchartChunk[] = [];
+		const streamed = await parsePythonWithAST(smallModule, {}, undefined, undefined, chunk => chunks.push(chunk));
+		const serial = await parsePythonWithAST(smallModule);
+
+		assert.deepStrictEqual(chunks.map(chunk => chunk.kind), ['outline', 'main', 'def']);
+		// 預覽的主流程節點以 main_ 前綴區隔，不與函式片段的編號衝突
+		assert.ok(chunks[1].lines.some(line => line.includes('main_node1')));
+		assert.ok(chunks[2].lines.some(line => line.includes('node1')));
+		assert.deepStrictEqual(streamed, serial);
+	});
+
+	test('Streamed and non-streamed results match on a larger module', async () => {
+		const code = largeModule(20, 12);
+		const externalModules = { helpers: { run: { file: '/ws/helpers.py', line: 1 } } };
+		const streamed = await parsePythonWithAST(code, externalModules, undefined, undefined, () => undefined);
+		const serial = await parsePythonWithAST(code, externalModules);
+
+		assert.deepStrictEqual(streamed, serial);
+	});
+
+	test('Parallel analysis matches serial analysis', async function () {
+		this.timeout(60000);
+		const code = largeModule(60, 60);
+		const externalModules = { helpers: { run: { file: '/ws/helpers.py', line: 1 } } };
+
+		// 分析器照指定的行程數開啟行程池，單核機器上也會真的走平行路徑
+		const serial = await parsePythonWithAST(code, externalModules, undefined, undefined, undefined, 0);
+		const parallel = await parsePythonWithAST(code, externalModules, undefined, undefined, undefined, 4);
+
+		assert.strictEqual(parallel.mermaidCode, serial.mermaidCode);
+		assert.strictEqual(parallel.lineMapping, serial.lineMapping);
+		assert.strictEqual(parallel.nodeSequence, serial.nodeSequence);
+		assert.strictEqual(parallel.nodeMeta, serial.nodeMeta);
+		assert.strictEqual(parallel.metrics, serial.metrics);
+	});
+
+	test('Branch labels only go on edges leaving the branch node', async () => {
+		// 函式 node2 的 ID func_node2 以 if 節點的 ID 結尾，其邊不可被標成 Yes
+		const code = ['def node2():', '    return 1', 'if x:', '    def g():', '        return 2'].join('\n');
+		const lines = (await parsePythonWithAST(code)).mermaidCode.split('\n').map(line => line.trim());
+
+		assert.ok(lines.includes('func_node2 --> node1'));
+		assert.ok(!lines.some(line => line.startsWith('func_node2 -->|')));
+	});
+
+	test('Labels come from the source text, joined, truncated and escaped', async () => {
+		const code = ['名字 = "café" + \'x\'', 'if 名字 != "é" and ok(名字):', '    total = compute(1,', '        2)',
+			'result = some_function_with_a_long_name(alpha, beta, gamma)'].join('\n');
+		const analysis = await parsePythonWithAST(code, {}, undefined, 30);
+		const meta = JSON.parse(analysis.nodeMeta);
+
+		// 位移以 UTF-8 位元組計算，非 ASCII 字元之後的片段也要切在正確位置
+		assert.strictEqual(meta.node2.label, 'if 名字 != "é" and ok(名字)');
+		assert.strictEqual(meta.node3.label, 'total = compute(1, 2)');
+		assert.strictEqual(meta.node4.label, 'result = some_function_with_a_long_name(alpha, beta, gamma)');
+		assert.strictEqual(meta.node4.escaped_label, 'result = some_function_with_a…');
+
+		const lines = analysis.mermaidCode.split('\n').map(line => line.trim());
+		assert.ok(lines.includes('node1["名字 = &quot;café&quot; + &apos;x&apos;"]'));
+		assert.ok(lines.includes('node2{"if 名字 != &quot;é&quot; and ok&#40;名字&#41;"}'));
+		assert.ok(lines.includes('node3["total = compute&#40;1, 2&#41;"]'));
+	});
+
+	test('Local pseudocode maps each line back to the source', async () => {
+		const code = ['def total(items):', '    s = 0', '    for x in items:', '        if x > 0:', '            s += x',
+			'    return s', '', 'print(total([1, -2]))'].join('\n');
+		const result = JSON.parse(await generateLocalPseudocode(code));
+
+		assert.strictEqual(result.pseudocode, ['FUNCTION total(items)', '    SET s = 0', '    FOR EACH x IN items DO',
+			'        IF x > 0 THEN', '            SET s = s + x', '    RETURNS s', 'OUTPUT total([1, -2])'].join('\n'));
+		assert.deepStrictEqual(result.lineMapping.map((entry: any) => [entry.pythonLine, entry.pseudocodeLine]),
+			[[1, 1], [2, 2], [3, 3], [4, 4], [5, 5], [6, 6], [8, 7]]);
+
+		// 只跑 pseudocode 的結果與完整分析附帶的相同
+		const analysis = await parsePythonWithAST(code);
+		assert.deepStrictEqual(result, JSON.parse(analysis.pseudocode));
+	});
+
+	test('Metrics report complexity, loop order and hotspots for nested loops', async () => {
+		const code = ['def pairs(items):', '    out = []', '    for a in items:', '        for b in items:', '            if a < b:',
+			'                out.append(lookup(a, b))', '    return out', '', 'def scan(items):', '    for a in items:', '        print(a)'].join('\n');
+		const metrics = JSON.parse((await parsePythonWithAST(code)).metrics);
+
+		assert.deepStrictEqual(metrics.functions.map((fn: any) => [fn.name, fn.nodeId, fn.complexity, fn.maxLoopDepth, fn.order]), [
+			['<module>', 'Start', 1, 0, 0], ['pairs', 'func_pairs', 4, 2, 2], ['scan', 'func_scan', 2, 1, 1]
+		]);
+		assert.deepStrictEqual(metrics.functions[1].loopCalls.map((call: any) => [call.call, call.line]),
+			[['out.append', 6], ['lookup', 6]]);
+		// 只有 O(n²) 以上的迴圈列為熱點，標在內層迴圈的節點上
+		assert.deepStrictEqual(metrics.loops, [{ nodeId: 'node3', line: 4, depth: 2, order: 2 }]);
+	});
+
+	test('Same-named nested functions do not share a metrics node', async () => {
+		const code = ['def run():', '    def helper(n):', '        return n', '    return helper(1)', '',
+			'def other():', '    def helper(n):', '        return n', '    return helper(2)'].join('\n');
+		const metrics = JSON.parse((await parsePythonWithAST(code)).metrics);
+
+		// 兩個 helper 在圖中是同一個節點，只有節點定義行所在的那一個對應到它
+		assert.deepStrictEqual(metrics.functions.map((fn: any) => [fn.name, fn.line, fn.nodeId]), [
+			['<module>', 1, 'Start'], ['run', 1, 'func_run'], ['other', 6, 'func_other'], ['helper', 2, null], ['helper', 7, 'func_helper']
+		]);
+	});
+
+	test('Prompt skeleton keeps original line numbers', async () => {
+		const code = ['"""Module doc."""', '# comment', 'def total(items):', '    """Sum."""',
+			'    result = sum(', '        items,', '    )', '    return result', ''].join('\n');
+		const skeleton = await generatePromptSkeleton(code);
+
+		assert.strictEqual(skeleton.skeleton, ['3| def total(items):', '5|     result = sum(items)', '8|     return result'].join('\n'));
+		// 多行語句記錄最後一行，供回應中的行號對回整段
+		assert.deepStrictEqual(skeleton.ranges, { '3': 3, '5': 7, '8': 8 });
+	});
+});
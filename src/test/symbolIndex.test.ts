@@ -0,0 +1,28 @@
+import * as assert from 'assert';
+import { moduleCandidates, submoduleSpec } from '../symbolIndex';
+
+suite('Symbol Index Test Suite', () => {
+	test('Relative imports resolve against the importer package', () => {
+		assert.deepStrictEqual(moduleCandidates('.utils', 'pkg.mod', false), ['pkg.utils']);
+		assert.deepStrictEqual(moduleCandidates('..core', 'pkg.sub.mod', false), ['pkg.core']);
+		assert.deepStrictEqual(moduleCandidates('.', 'pkg.mod', false), ['pkg']);
+		assert.deepStrictEqual(moduleCandidates('...core', 'pkg.mod', false), []);
+	});
+
+	test('pkg/__init__.py is its own package', () => {
+		assert.deepStrictEqual(moduleCandidates('.utils', 'pkg', true), ['pkg.utils']);
+		assert.deepStrictEqual(moduleCandidates('..core', 'pkg.sub', true), ['pkg.core']);
+	});
+
+	test('Absolute imports also try the importer directory', () => {
+		assert.deepStrictEqual(moduleCandidates('helpers', 'scripts.run', false), ['helpers', 'scripts.helpers']);
+		assert.deepStrictEqual(moduleCandidates('helpers', 'run', false), ['helpers']);
+	});
+
+	test('Submodules imported with from ... import', () => {
+		assert.strictEqual(submoduleSpec('.', 'mod'), '.mod');
+		assert.strictEqual(submoduleSpec('..pkg', 'mod'), '..pkg.mod');
+		assert.strictEqual(submoduleSpec('pkg', 'mod'), 'pkg.mod');
+		assert.deepStrictEqual(moduleCandidates(submoduleSpec('.', 'mod'), 'pkg', true), ['pkg.mod']);
+	});
+});